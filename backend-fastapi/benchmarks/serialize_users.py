@@ -0,0 +1,87 @@
+"""
+benchmark serializing users lists, model per row vs straight from rows.
+
+    uv run python benchmarks/serialize_users.py [ROWS ...]
+
+runs the query against an in-memory sqlite db, so the times include fetching
+rows but not network or postgres costs.
+"""
+
+from datetime import date
+import sys
+import time
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, insert, select
+
+from userdb.models.user import User, UserPublic
+from userdb.routers.users import PUBLIC_COLUMNS, users_json
+from userdb.utils.ids import uuid7
+
+DEFAULT_ROWS = [10_000, 100_000]
+REPEATS = 3
+
+
+def model_per_row(session: Session) -> bytes:
+    """the previous path: load User entities and validate each into UserPublic"""
+    users = session.exec(select(User)).all()
+    return (
+        "["
+        + ",".join(
+            UserPublic.model_validate(user).model_dump_json(by_alias=True)
+            for user in users
+        )
+        + "]"
+    ).encode()
+
+
+def straight_from_rows(session: Session) -> bytes:
+    """select the public columns and dump the rows with a cached TypeAdapter"""
+    return users_json(session.exec(select(*PUBLIC_COLUMNS)).all())
+
+
+def best_time(func, session: Session) -> float:
+    """fastest of REPEATS runs, in seconds"""
+    times = []
+    for _ in range(REPEATS):
+        session.expunge_all()
+        start = time.perf_counter()
+        func(session)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(row_counts: list[int]) -> None:
+    """print timings for each row count"""
+    print(f"{'rows':>8} {'model per row':>14} {'from rows':>10} {'speedup':>8}")
+
+    for rows in row_counts:
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        SQLModel.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            session.exec(
+                insert(User),  # type: ignore[call-overload]
+                params=[
+                    {
+                        "id": uuid7(),
+                        "firstname": "Zoë",
+                        "lastname": "Ødegård",
+                        "date_of_birth": date(1990, 1, 1),
+                    }
+                    for _ in range(rows)
+                ],
+            )
+            session.commit()
+
+            assert model_per_row(session) == straight_from_rows(session)
+
+            old = best_time(model_per_row, session)
+            new = best_time(straight_from_rows, session)
+
+        engine.dispose()
+        print(f"{rows:>8} {old:>13.3f}s {new:>9.3f}s {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
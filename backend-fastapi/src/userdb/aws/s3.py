@@ -3,7 +3,6 @@
 import functools
 import re
 import uuid
-import boto3
 import os
 
 from userdb.aws import ssm
@@ -15,6 +14,9 @@ PRESIGN_EXPIRY_SECONDS = 60
 
 @functools.lru_cache(maxsize=1)
 def _client():
+    # boto3 is slow to import and heavy, so only load it once a worker needs AWS
+    import boto3  # pylint: disable=import-outside-toplevel
+
     return boto3.client(
         "s3",
         region_name=os.environ["AWS_REGION"],
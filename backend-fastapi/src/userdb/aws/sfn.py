@@ -3,7 +3,6 @@
 import asyncio
 import functools
 import json
-import boto3
 import os
 
 from userdb.aws import s3, ssm, textract
@@ -18,6 +17,8 @@ _logger = log.get_logger(__name__)
 
 @functools.lru_cache(maxsize=1)
 def _client():
+    import boto3  # pylint: disable=import-outside-toplevel
+
     return boto3.client(
         "stepfunctions",
         region_name=os.environ["AWS_REGION"],
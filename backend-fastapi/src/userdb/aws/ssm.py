@@ -3,7 +3,6 @@
 from enum import StrEnum
 import functools
 import os
-import boto3
 
 
 class Parameter(StrEnum):
@@ -15,6 +14,8 @@ class Parameter(StrEnum):
 
 @functools.lru_cache(maxsize=1)
 def _client():
+    import boto3  # pylint: disable=import-outside-toplevel
+
     return boto3.client(
         "ssm",
         region_name=os.environ["AWS_REGION"],
@@ -26,3 +27,9 @@ def get_parameter(name: Parameter) -> str:
     """Get a parameter value from AWS Parameter Store."""
     response = _client().get_parameter(Name=name)
     return response["Parameter"]["Value"]
+
+
+def prefetch_parameters() -> None:
+    """Load every parameter into the cache, e.g. at startup."""
+    for name in Parameter:
+        get_parameter(name)
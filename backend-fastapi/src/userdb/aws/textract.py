@@ -3,7 +3,6 @@
 from datetime import date
 import re
 from typing import Iterable
-import dateutil
 
 from userdb.responses import SuccessResult
 from userdb.utils import log
@@ -203,8 +202,11 @@ def _parse_dob(dob: str) -> date | None:
         _logger.info("No date of birth detected in Textract results")
         return None
 
+    # only needed for document processing, so load it on first use
+    from dateutil import parser  # pylint: disable=import-outside-toplevel
+
     try:
-        parsed_date = dateutil.parser.parse(dob, dayfirst=True, fuzzy=True)
+        parsed_date = parser.parse(dob, dayfirst=True, fuzzy=True)
         _logger.info(
             "Parsed date of birth %s from Textract input: %s", parsed_date, dob
         )
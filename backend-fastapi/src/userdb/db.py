@@ -1,28 +1,232 @@
 """initialises postgres db"""
 
+import contextlib
+from enum import StrEnum
+import itertools
 import logging
 import os
-from typing import Annotated
+import sqlite3
+import time
+from typing import Annotated, Any
 from fastapi import Depends
-from sqlmodel import Session, SQLModel, create_engine
+from redis.exceptions import RedisError
+from sqlalchemy import Connection, Engine, event, exc, extract, func, inspect, text
+from sqlalchemy.dialects.sqlite.aiosqlite import AsyncAdapt_aiosqlite_connection
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import Session, SQLModel, create_engine, insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from userdb import redis as redis_store
+from userdb.models.metrics import DbPoolStats
 
 # pylint: disable=unused-import
+from userdb.models.stats import UserBirthYearCount
 from userdb.models.user import User
+from userdb.utils import search
+from userdb.utils.auth import CURRENT_USER, CurrentUser
 
 _logger = logging.getLogger(__name__)
 
+# indexes that have been replaced, dropped from existing databases at startup
+OBSOLETE_INDEXES = ["ix_user_created_at_id"]
+
+# trigram index for name search on postgres. the indexed expression must match
+# `folded(user_search_name())` as compiled for postgres, or searches won't use it
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() is only STABLE, so wrap it to allow use in an index
+    "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+    "AS $$ SELECT public.unaccent('public.unaccent', $1) $$",
+    'CREATE INDEX IF NOT EXISTS ix_user_active_name_trgm ON "user" '
+    "USING gin (f_unaccent(lower(firstname || ' ' || lastname)) gin_trgm_ops) "
+    "WHERE deleted = false",
+]
+
 
-def db_url():
+def db_url(driver: str = "postgresql+psycopg2", host: str | None = None):
     """get postgres connection url with dev server defaults"""
     user = os.getenv("POSTGRES_USER", "postgres")
     password = os.getenv("POSTGRES_PASSWORD", "postgresP")
-    host = os.getenv("POSTGRES_HOST", "localhost:5432")
+    host = host or os.getenv("POSTGRES_HOST", "localhost:5432")
     db_name = os.getenv("POSTGRES_DB", "users")
-    return f"postgresql://{user}:{password}@{host}/{db_name}"
+    return f"{driver}://{user}:{password}@{host}/{db_name}"
+
+
+def pool_options() -> dict[str, Any]:
+    """
+    connection pool settings from env. sizes are per engine, so per worker process.
+    - `DB_POOL_SIZE`: connections kept open (default 5)
+    - `DB_MAX_OVERFLOW`: extra connections allowed under load (default 10)
+    - `DB_POOL_TIMEOUT`: seconds to wait for a free connection (default 30)
+    - `DB_POOL_RECYCLE`: seconds before a connection is replaced (default 1800)
+    - `DB_POOL_PRE_PING`: test connections on checkout (default true)
+    """
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true") == "true",
+    }
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
 
 
+# sync engine for schema management at startup
 engine = create_engine(db_url())
 
+# async engine for request handlers, so queries don't block the event loop
+async_engine = create_async_engine(
+    db_url("postgresql+asyncpg"),
+    poolclass=TimedAsyncQueuePool,
+    **pool_options(),
+)
+
+
+def replica_hosts() -> list[str]:
+    """read replica `host:port`s from comma separated `POSTGRES_REPLICA_HOSTS`"""
+    hosts = os.getenv("POSTGRES_REPLICA_HOSTS", "")
+    return [host.strip() for host in hosts.split(",") if host.strip()]
+
+
+class ReplicaSelection(StrEnum):
+    """strategies for spreading reads over replicas"""
+
+    ROUND_ROBIN = "round_robin"
+    LEAST_CONNECTIONS = "least_connections"
+
+
+class ReplicaSelector:
+    """Picks a replica engine for each read-only session."""
+
+    def __init__(self, engines: list[AsyncEngine], strategy: ReplicaSelection):
+        self.engines = engines
+        self.strategy = strategy
+        self._cycle = itertools.cycle(engines)
+
+    def choose(self) -> AsyncEngine:
+        """next replica to read from"""
+        if self.strategy == ReplicaSelection.LEAST_CONNECTIONS:
+            return min(
+                self.engines,
+                key=lambda e: e.pool.checkedout(),  # type: ignore[attr-defined]
+            )
+        return next(self._cycle)
+
+
+# async engines for read replicas, empty if none are configured
+replica_engines = [
+    create_async_engine(
+        db_url("postgresql+asyncpg", host=host),
+        poolclass=TimedAsyncQueuePool,
+        **pool_options(),
+    )
+    for host in replica_hosts()
+]
+
+replicas = ReplicaSelector(
+    replica_engines,
+    ReplicaSelection(os.getenv("DB_REPLICA_SELECTION", "round_robin")),
+)
+
+# how long a user's reads go to the primary after they write, to cover replica lag
+READ_YOUR_WRITES_SECONDS = int(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+
+async def record_write(username: str) -> None:
+    """
+    note that the user has written to the primary, so that their reads stick to it
+    for `READ_YOUR_WRITES_SECONDS`. no-op without replicas.
+    """
+    if not replicas.engines:
+        return
+
+    try:
+        await redis_store.mark_recent_db_write(
+            username, ex_seconds=READ_YOUR_WRITES_SECONDS
+        )
+    except RedisError:
+        _logger.exception("failed to record db write for %s", username)
+
+
+async def read_engine(username: str) -> AsyncEngine:
+    """engine to serve a user's read-only queries"""
+    if not replicas.engines:
+        return async_engine
+
+    try:
+        if await redis_store.has_recent_db_write(username):
+            return async_engine
+    except RedisError:
+        _logger.exception("failed to check recent db writes, reading from primary")
+        return async_engine
+
+    return replicas.choose()
+
+
+async def warm_up_pool(engine_: AsyncEngine, connections: int) -> None:
+    """
+    open up to `connections` pooled connections, so the first requests don't pay
+    for connecting
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        # hold each connection until all are open so they're distinct
+        for _ in range(connections):
+            conn = await stack.enter_async_context(engine_.connect())
+            await conn.execute(text("SELECT 1"))
+
+
+async def dispose_engines() -> None:
+    """close every pooled connection, e.g. at shutdown"""
+    for engine_ in [async_engine, *replica_engines]:
+        await engine_.dispose()
+    engine.dispose()
+
+
+def pool_stats(engine_: AsyncEngine) -> DbPoolStats:
+    """live statistics for an engine's connection pool (this process only)"""
+    pool = engine_.pool
+    stats = DbPoolStats(
+        size=pool.size(),  # type: ignore[attr-defined]
+        checked_in=pool.checkedin(),  # type: ignore[attr-defined]
+        checked_out=pool.checkedout(),  # type: ignore[attr-defined]
+        # negative until the pool has opened pool_size connections
+        overflow=max(pool.overflow(), 0),  # type: ignore[attr-defined]
+    )
+
+    if isinstance(pool, TimedAsyncQueuePool):
+        stats.checkouts = pool.checkouts
+        stats.timeouts = pool.timeouts
+        stats.total_wait_seconds = pool.total_wait_seconds
+        stats.max_wait_seconds = pool.max_wait_seconds
+
+    return stats
+
 
 def init_db() -> None:
     """initialize database with configured tables"""
@@ -35,6 +239,92 @@ def init_db() -> None:
 
     SQLModel.metadata.create_all(engine)
 
+    migrate_user_primary_key(engine)
+
+    # create_all skips existing tables, so make sure indexes added since exist too
+    for index in User.__table__.indexes:  # type: ignore[attr-defined]
+        index.create(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+        if engine.dialect.name == "postgresql":
+            for statement in POSTGRES_SEARCH_DDL:
+                conn.execute(text(statement))
+
+        backfill_user_stats(conn)
+
+
+def backfill_user_stats(conn: Connection) -> None:
+    """
+    fill the stats counts from the user table if they're empty, e.g. the first
+    time the app starts against an existing database
+    """
+    # pylint: disable=singleton-comparison,not-callable
+
+    if conn.execute(select(UserBirthYearCount.birth_year).limit(1)).first():
+        return
+
+    birth_year = extract("year", User.date_of_birth)
+    conn.execute(
+        insert(UserBirthYearCount).from_select(
+            ["birth_year", "count"],
+            select(birth_year, func.count())
+            .where(User.deleted == False)
+            .group_by(birth_year),
+        )
+    )
+
+
+@event.listens_for(Engine, "connect")
+def _register_sqlite_functions(dbapi_connection, _connection_record) -> None:
+    """
+    sqlite has no unaccent, so provide `search.folded` as a python function
+    (used by the sqlite test db)
+    """
+    if isinstance(
+        dbapi_connection, (sqlite3.Connection, AsyncAdapt_aiosqlite_connection)
+    ):
+        dbapi_connection.create_function(
+            search.SQLITE_FOLD_FUNCTION, 1, _fold_or_none, deterministic=True
+        )
+
+
+def _fold_or_none(value: str | None) -> str | None:
+    return None if value is None else search.fold(value)
+
+
+def migrate_user_primary_key(engine_: Engine) -> None:
+    """
+    users used to have a composite (id, created_at) primary key. switch existing
+    tables to an id-only key so lookups by id are a single index probe. existing
+    ids are kept as they are; only new rows get time-ordered ids.
+    """
+    table = User.__table__.name  # type: ignore[attr-defined]
+    pk = inspect(engine_).get_pk_constraint(table)
+
+    if pk["constrained_columns"] == ["id"]:
+        return
+
+    if engine_.dialect.name != "postgresql":
+        _logger.warning(
+            "can't migrate %s primary key %s on %s",
+            table,
+            pk["constrained_columns"],
+            engine_.dialect.name,
+        )
+        return
+
+    _logger.info("migrating %s primary key to (id)", table)
+    with engine_.begin() as conn:
+        conn.execute(
+            text(
+                f'ALTER TABLE "{table}" DROP CONSTRAINT "{pk["name"]}", '
+                "ADD PRIMARY KEY (id)"
+            )
+        )
+
 
 def get_session():
     """get db session"""
@@ -43,3 +333,25 @@ def get_session():
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
+
+
+async def get_async_session():
+    """get async db session"""
+    # objects are used after commit when building responses, so don't expire them
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+
+
+async def get_read_session(user: CurrentUser = CURRENT_USER):
+    """
+    get async db session for read-only queries, on a replica if any are configured
+    """
+    engine_ = await read_engine(user.username)
+    async with AsyncSession(engine_, expire_on_commit=False) as session:
+        yield session
+
+
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
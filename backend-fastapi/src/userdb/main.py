@@ -1,20 +1,28 @@
 """initialise the FastAPI app"""
 
 from contextlib import asynccontextmanager
+import os
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from userdb import db
-from userdb.routers import auth, documents, users
+from userdb import db, resources, serve
+from userdb.routers import auth, documents, metrics, users
 from userdb.middleware.jwt_auth import jwt_auth_middleware
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    """lifespan handler for DB. Initialises tables at startup."""
-    db.init_db()
+    """
+    lifespan handler. Initialises tables at startup, unless already done by
+    `userdb.serve` before starting workers, and warms up connections.
+    Connections are closed at shutdown.
+    """
+    if os.getenv(serve.SKIP_INIT_DB_ENV) != "true":
+        db.init_db()
+    await resources.warm_up()
     yield
+    await resources.release()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -31,10 +39,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["ETag", users.NEXT_CURSOR_HEADER],
 )
 
 app.include_router(auth.router)
 app.include_router(documents.router)
+app.include_router(metrics.router)
 app.include_router(users.router)
 
 
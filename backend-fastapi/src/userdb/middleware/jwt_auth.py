@@ -1,7 +1,7 @@
 """JWT auth middleware.
 
-Validates Bearer JWTs on protected endpoints and checks Redis-backed
-access-token revocation.
+Validates Bearer JWTs on protected endpoints and checks them against the user's
+token generation.
 """
 
 from typing import Callable
@@ -9,8 +9,8 @@ from typing import Callable
 from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
 
+from userdb import revocations
 from userdb.utils import auth, log
-from userdb.redis import is_access_token_revoked
 
 
 _logger = log.get_logger(__name__)
@@ -68,17 +68,17 @@ async def jwt_auth_middleware(request: Request, call_next: Callable):
 
     token = auth_header.split(" ", 1)[1].strip()
 
-    if await is_access_token_revoked(token):
-        return JSONResponse(
-            status_code=401,
-            content={"detail": "Token revoked"},
-        )
-
     try:
         payload = auth.verify_access_token(token)
     except HTTPException as exc:
         return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
+    if await revocations.is_revoked(payload):
+        return JSONResponse(
+            status_code=401,
+            content={"detail": "Token revoked"},
+        )
+
     request.state.user = get_user_from_token(payload)
 
     return await call_next(request)
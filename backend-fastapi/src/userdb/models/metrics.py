@@ -0,0 +1,54 @@
+"""runtime metrics model classes"""
+
+from humps import camel
+from pydantic import BaseModel
+
+
+class DbPoolStats(BaseModel):
+    """database connection pool statistics for a single worker process"""
+
+    model_config = {
+        "alias_generator": camel.case,
+        "validate_by_name": True,
+    }
+
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int = 0
+    timeouts: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class RedisCommandStats(BaseModel):
+    """latency of one Redis command for a single worker process"""
+
+    model_config = {
+        "alias_generator": camel.case,
+        "validate_by_name": True,
+    }
+
+    count: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class RedisStats(BaseModel):
+    """Redis connection pool and command statistics for a single worker process"""
+
+    model_config = {
+        "alias_generator": camel.case,
+        "validate_by_name": True,
+    }
+
+    max_connections: int
+    in_use: int
+    available: int
+    checkouts: int = 0
+    timeouts: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    commands: dict[str, RedisCommandStats] = {}
@@ -0,0 +1,42 @@
+"""user statistics model classes"""
+
+from humps import camel
+from sqlmodel import Field, SQLModel
+
+
+class UserBirthYearCount(SQLModel, table=True):
+    """
+    number of active users born in each year.
+    kept up to date by the user write handlers in the same transaction as the
+    write, so stats never need to scan the user table.
+    """
+
+    __tablename__ = "user_birth_year_count"  # type: ignore[assignment]
+
+    birth_year: int = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
+class UserAgeBand(SQLModel):
+    """number of active users in an age range (inclusive, open ended if None)"""
+
+    model_config = {
+        "alias_generator": camel.case,
+        "validate_by_name": True,
+    }
+
+    min_age: int | None
+    max_age: int | None
+    count: int
+
+
+class UserStats(SQLModel):
+    """active user statistics"""
+
+    model_config = {
+        "alias_generator": camel.case,
+        "validate_by_name": True,
+    }
+
+    total: int
+    age_bands: list[UserAgeBand]
@@ -1,12 +1,17 @@
 """user model classes"""
 
 from datetime import datetime, date
+from enum import StrEnum
 import re
+from typing import Any, TypedDict
 import uuid
 from fastapi import HTTPException, status
 from humps import camel
-from sqlmodel import Field, SQLModel
-from pydantic import field_validator
+from sqlmodel import Field, Index, SQLModel, text
+from pydantic import ConfigDict, field_validator
+from sqlalchemy import literal_column
+
+from userdb.utils.ids import uuid7
 
 
 NAME_ALLOWED_CHARS = re.compile(r"^['A-Za-zÀ-ÖØ-öø-ÿ- ]+$")
@@ -82,14 +87,91 @@ class UserPublic(UserBase):
     id: uuid.UUID
 
 
+class UserPublicRow(TypedDict):
+    """
+    UserPublic fields as a plain dict, e.g. a query row's `_asdict()`.
+    serializing rows with a TypeAdapter of this skips building and validating a
+    model per row, which dominates the cost of large responses.
+    """
+
+    __pydantic_config__ = ConfigDict(alias_generator=camel.case)  # type: ignore[misc]
+
+    firstname: str
+    lastname: str
+    date_of_birth: date
+    id: uuid.UUID
+
+
+class UserBulkCreateError(SQLModel):
+    """a row from a bulk create request that failed validation"""
+
+    index: int
+    detail: Any
+
+
+class UserBulkCreateResult(SQLModel):
+    """outcome of a bulk create request"""
+
+    model_config = {
+        "alias_generator": camel.case,
+        "validate_by_name": True,
+    }
+
+    created: list[UserPublic]
+    errors: list[UserBulkCreateError]
+
+
+class UserBulkDeleteResult(SQLModel):
+    """outcome of a bulk delete request"""
+
+    deleted: list[uuid.UUID]
+
+
+class UserSort(StrEnum):
+    """supported orderings for listing users"""
+
+    CREATED_AT = "created_at"
+    CREATED_AT_DESC = "-created_at"
+
+
+class UserExportFormat(StrEnum):
+    """supported formats for exporting users"""
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
 class User(UserBase, table=True):
     """full User entity"""
 
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.now, primary_key=True)
+    __table_args__ = (
+        # keyset pagination over active users (see UserSort). every read filters
+        # on deleted = false, so deleted rows are left out of the index, and the
+        # public columns are included so exports can be served from the index alone
+        Index(
+            "ix_user_active_created_at_id",
+            "created_at",
+            "id",
+            postgresql_where=text("deleted = false"),
+            postgresql_include=["firstname", "lastname", "date_of_birth"],
+            sqlite_where=text("deleted = 0"),
+        ),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid7, primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.now)
     deleted: bool = Field(default=False)
 
 
+def user_search_name():
+    """
+    "firstname lastname" expression searched by /users/search.
+    the space is inlined rather than bound so postgres can match it to the search
+    index expression.
+    """
+    return User.firstname + literal_column("' '") + User.lastname
+
+
 class ProcessedUserData(SQLModel):
     """Container for user data extracted from Textract results"""
 
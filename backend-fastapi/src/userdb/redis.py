@@ -2,106 +2,690 @@
 
 from __future__ import annotations
 
+import asyncio
 from functools import lru_cache
-import hashlib
+import math
 import os
+import time
 from typing import Any
 
 import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline, PubSub
+from redis.asyncio.cluster import ClusterPipeline, RedisCluster
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.asyncio.sentinel import Sentinel
+from redis.commands.core import AsyncScript
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisClusterException, ResponseError
 
+from userdb.models.metrics import RedisCommandStats, RedisStats
 
-def get_redis() -> aioredis.Redis:
+
+def get_redis() -> aioredis.Redis | RedisCluster:
     """Return a singleton Redis client (cached)."""
     return _get_redis_client()
 
 
+def pool_options() -> dict[str, Any]:
+    """Redis connection pool settings, tunable from env."""
+    return {
+        "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+        # how long a command waits for a free connection before failing
+        "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", "2")),
+        "socket_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", "1")),
+        "socket_connect_timeout": float(os.getenv("REDIS_CONNECT_TIMEOUT", "1")),
+        "health_check_interval": int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+        # retries connection errors and timeouts, so a non-idempotent command
+        # can rarely run twice. REDIS_RETRIES=0 turns this off.
+        "retry": Retry(
+            ExponentialBackoff(cap=0.5, base=0.05),
+            int(os.getenv("REDIS_RETRIES", "2")),
+        ),
+    }
+
+
+class TimedBlockingConnectionPool(aioredis.BlockingConnectionPool):
+    """Blocking pool that records how long commands wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except RedisConnectionError as exc:
+            if isinstance(exc.__cause__, asyncio.TimeoutError):
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+class _CommandTimer:
+    """records latency per command (this process only) for a Redis client class"""
+
+    # pylint: disable=no-member
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.command_stats: dict[str, RedisCommandStats] = {}
+
+    async def execute_command(self, *args, **options):
+        """run a command, recording its latency"""
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.record(str(args[0]).upper(), time.perf_counter() - start, failed)
+
+    def record(self, command: str, seconds: float, failed: bool) -> None:
+        """add a command's latency to the stats"""
+        stats = self.command_stats.setdefault(command, RedisCommandStats())
+        stats.count += 1
+        stats.errors += failed
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+
+
+class _PipelineTimer:
+    """records a pipeline's round trip on its client as a MULTI or PIPELINE command"""
+
+    # pylint: disable=no-member
+
+    def __init__(self, client: _CommandTimer, transaction: bool, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timer = client
+        self._timed_as = "MULTI" if transaction else "PIPELINE"
+
+    async def execute(self, *args, **kwargs):
+        """send the queued commands, recording the round trip's latency"""
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await super().execute(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._timer.record(self._timed_as, time.perf_counter() - start, failed)
+
+
+# pylint: disable-next=abstract-method,too-many-ancestors
+class TimedPipeline(_PipelineTimer, Pipeline):
+    """pipeline recorded on a TimedRedis client"""
+
+
+# pylint: disable-next=abstract-method,too-many-ancestors
+class TimedClusterPipeline(_PipelineTimer, ClusterPipeline):
+    """pipeline recorded on a TimedRedisCluster client"""
+
+
+# pylint: disable-next=abstract-method,too-many-ancestors
+class TimedRedis(_CommandTimer, aioredis.Redis):
+    """Redis client that records latency per command (this process only)."""
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None):
+        return TimedPipeline(
+            self,
+            transaction,
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
+# pylint: disable-next=abstract-method,too-many-ancestors
+class TimedRedisCluster(_CommandTimer, RedisCluster):
+    """Redis Cluster client that records latency per command (this process only)."""
+
+    def pipeline(self, transaction: bool | None = None, shard_hint: Any = None):
+        if shard_hint:
+            raise RedisClusterException("shard_hint is deprecated in cluster mode")
+        return TimedClusterPipeline(self, bool(transaction), self, transaction)
+
+
+REDIS_MODES = ("standalone", "cluster", "sentinel")
+
+
+def redis_mode() -> str:
+    """
+    How to connect to Redis, from REDIS_MODE:
+    standalone (REDIS_HOST), cluster (REDIS_HOST is any node of the cluster) or
+    sentinel (REDIS_SENTINELS, e.g. "sentinel-1:26379,sentinel-2:26379").
+    """
+    mode = os.getenv("REDIS_MODE", "standalone").lower()
+    if mode not in REDIS_MODES:
+        raise ValueError(f"REDIS_MODE must be one of {', '.join(REDIS_MODES)}")
+    return mode
+
+
+def sentinel_hosts() -> list[tuple[str, int]]:
+    """(host, port) of each sentinel in REDIS_SENTINELS"""
+    hosts = []
+    for address in os.getenv("REDIS_SENTINELS", "").split(","):
+        if address.strip():
+            host, _, port = address.strip().rpartition(":")
+            hosts.append((host, int(port)) if host else (port, 26379))
+    return hosts
+
+
 @lru_cache(maxsize=1)
-def _get_redis_client() -> aioredis.Redis:
+def _get_redis_client() -> aioredis.Redis | RedisCluster:
     host = os.environ.get("REDIS_HOST", "redis")
     port = int(os.environ.get("REDIS_PORT", "6379"))
     db = int(os.environ.get("REDIS_DB", "0"))
-    return aioredis.Redis(
+    options = pool_options()
+
+    match redis_mode():
+        case "cluster":
+            # cluster nodes only have db 0, and a pool per node that doesn't block
+            del options["timeout"]
+            return TimedRedisCluster(
+                host=host, port=port, decode_responses=True, **options
+            )
+        case "sentinel":
+            del options["timeout"]
+            sentinel = Sentinel(
+                sentinel_hosts(),
+                sentinel_kwargs={
+                    "socket_timeout": options["socket_timeout"],
+                    "socket_connect_timeout": options["socket_connect_timeout"],
+                },
+            )
+            return sentinel.master_for(
+                os.getenv("REDIS_SENTINEL_SERVICE", "mymaster"),
+                redis_class=TimedRedis,
+                db=db,
+                decode_responses=True,
+                **options,
+            )
+
+    pool = TimedBlockingConnectionPool(
         host=host,
         port=port,
         db=db,
         decode_responses=True,
+        **options,
     )
+    return TimedRedis.from_pool(pool)
+
 
+@lru_cache(maxsize=1)
+def _get_cluster_pubsub_client() -> aioredis.Redis:
+    # the async cluster client has no pub/sub, but messages published on any node
+    # reach subscribers on every node, so subscribe on the startup node
+    options = pool_options()
+    return aioredis.Redis(
+        host=os.environ.get("REDIS_HOST", "redis"),
+        port=int(os.environ.get("REDIS_PORT", "6379")),
+        decode_responses=True,
+        socket_timeout=options["socket_timeout"],
+        socket_connect_timeout=options["socket_connect_timeout"],
+        health_check_interval=options["health_check_interval"],
+        retry=options["retry"],
+    )
+
+
+def pubsub() -> PubSub:
+    """Return a new pub/sub connection, in any REDIS_MODE."""
+    client = get_redis()
+    if isinstance(client, RedisCluster):
+        return _get_cluster_pubsub_client().pubsub()
+    return client.pubsub()
+
+
+def _pool_usage(client: aioredis.Redis | RedisCluster) -> tuple[int, int, int]:
+    """max, in use and available connections, summed over nodes for a cluster"""
+    # pylint: disable=protected-access
+    if isinstance(client, RedisCluster):
+        nodes = client.get_nodes()
+        return (
+            sum(node.max_connections for node in nodes),
+            sum(len(node._connections) - len(node._free) for node in nodes),
+            sum(len(node._free) for node in nodes),
+        )
+
+    pool = client.connection_pool
+    return (
+        pool.max_connections,
+        len(pool._in_use_connections),
+        len(pool._available_connections),
+    )
+
+
+def redis_stats() -> RedisStats:
+    """Connection pool and command latency statistics for this process."""
+    client = _get_redis_client()
+    max_connections, in_use, available = _pool_usage(client)
+    stats = RedisStats(
+        max_connections=max_connections, in_use=in_use, available=available
+    )
 
-def refresh_token_key(refresh_token: str) -> str:
-    """Redis key for a single refresh token."""
-    return f"refresh_token:{refresh_token}"
+    pool = getattr(client, "connection_pool", None)
+    if isinstance(pool, TimedBlockingConnectionPool):
+        stats.checkouts = pool.checkouts
+        stats.timeouts = pool.timeouts
+        stats.total_wait_seconds = pool.total_wait_seconds
+        stats.max_wait_seconds = pool.max_wait_seconds
+    if isinstance(client, _CommandTimer):
+        stats.commands = client.command_stats
+
+    return stats
+
+
+async def close_redis() -> None:
+    """Close the singleton client and its connection pool, if it was created."""
+    # pylint: disable=too-many-function-args
+    if _get_redis_client.cache_info().currsize:
+        await _get_redis_client().aclose()
+        _get_redis_client.cache_clear()
+    if _get_cluster_pubsub_client.cache_info().currsize:
+        await _get_cluster_pubsub_client().aclose()
+        _get_cluster_pubsub_client.cache_clear()
+    _registered_script.cache_clear()
+
+
+def _script(lua: str) -> AsyncScript:
+    """
+    Return a callable for a Lua script on the current client. Calls use EVALSHA,
+    only sending the script body (SCRIPT LOAD) if the server hasn't cached it yet.
+    """
+    return _registered_script(get_redis(), lua)
+
+
+@lru_cache(maxsize=32)
+def _registered_script(client: aioredis.Redis, lua: str) -> AsyncScript:
+    # registering hashes the script, so do it once per client and script
+    return client.register_script(lua)
+
+
+def user_hash_tag(username: str) -> str:
+    """
+    Cluster hash tag for a user's keys. Only the part in braces is hashed, so all
+    of a user's token keys share a slot and multi-key scripts and transactions on
+    them stay on one shard.
+    """
+    return f"{{{username.lower()}}}"
+
+
+def refresh_token_key(username: str, refresh_token: str) -> str:
+    """Redis key for a single refresh token of a user."""
+    return f"refresh_token:{user_hash_tag(username)}:{refresh_token}"
 
 
 def user_refresh_tokens_key(username: str) -> str:
-    """Redis key for the set of refresh tokens for a user."""
+    """Redis key for the index of refresh tokens for a user."""
 
-    return f"user_refresh_tokens:{username.lower()}"
+    return f"user_refresh_tokens:{user_hash_tag(username)}"
 
 
-def revoked_access_token_key(access_token: str) -> str:
-    """Redis key for revoked access token marker (sha256 hashed)."""
-    token_hash = hashlib.sha256(access_token.encode("utf-8")).hexdigest()
-    return f"revoked_access:{token_hash}"
+TOKEN_GENERATION_PREFIX = "token_generation:"
 
+# "<generation>:<username>" is published here when a user's generation is bumped,
+# for workers' local caches
+TOKEN_GENERATIONS_CHANNEL = "token_generations"
+
+# users whose generation was bumped recently, scored by when the bump lapses, for
+# workers to load at startup without walking the keyspace
+TOKEN_GENERATION_BUMPS_KEY = "token_generation_bumps"
+
+
+def token_generation_key(username: str) -> str:
+    """
+    Redis key for a user's token generation. Access tokens minted with an older
+    generation are revoked.
+    """
+    return f"{TOKEN_GENERATION_PREFIX}{user_hash_tag(username)}"
 
-async def revoke_access_token(access_token: str, *, ttl_seconds: int) -> None:
-    """Mark an access token as revoked until it expires."""
-    if ttl_seconds <= 0:
-        return
-    await get_redis().set(revoked_access_token_key(access_token), "1", ex=ttl_seconds)
 
+USERS_LIST_VERSION_KEY = "users_list_version"
 
-async def is_access_token_revoked(access_token: str) -> bool:
-    """Return True if token has been revoked."""
-    value = await get_redis().get(revoked_access_token_key(access_token))
+
+def users_list_page_key(version: str, page: str) -> str:
+    """Redis key for a cached page of the users list at a given list version."""
+    return f"users_list:{version}:{page}"
+
+
+def _users_list_version_seed() -> str:
+    # the version starts from the clock rather than 0, so versions (and the ETags
+    # made from them) aren't reused after a restart or eviction loses the key
+    return str(time.time_ns())
+
+
+async def get_users_list_version() -> str:
+    """Return the current users list version, bumped on every write to users."""
+    redis = get_redis()
+    version = await redis.get(USERS_LIST_VERSION_KEY)
+    if version is None:
+        seed = _users_list_version_seed()
+        version = await redis.set(USERS_LIST_VERSION_KEY, seed, nx=True, get=True)
+        version = version or seed
+    return version
+
+
+async def bump_users_list_version() -> None:
+    """Move the users list to a new version so cached pages are no longer used."""
+    redis = get_redis()
+    # seeded first, as INCR would start a lost version again from 1
+    await redis.set(USERS_LIST_VERSION_KEY, _users_list_version_seed(), nx=True)
+    await redis.incr(USERS_LIST_VERSION_KEY)
+
+
+async def get_cached_users_page(key: str) -> Any:
+    """Return a cached users list page (or None)."""
+    return await get_redis().get(key)
+
+
+async def set_cached_users_page(key: str, page: str, *, ex_seconds: int) -> None:
+    """Cache a serialized users list page."""
+    await get_redis().set(key, page, ex=ex_seconds)
+
+
+def recent_db_write_key(username: str) -> str:
+    """Redis key marking that a user has recently written to the primary db."""
+    return f"recent_db_write:{username.lower()}"
+
+
+async def mark_recent_db_write(username: str, *, ex_seconds: int) -> None:
+    """Record that a user just wrote to the primary db."""
+    await get_redis().set(recent_db_write_key(username), "1", ex=ex_seconds)
+
+
+async def has_recent_db_write(username: str) -> bool:
+    """Return True if the user wrote to the primary db within the marker's TTL."""
+    value = await get_redis().get(recent_db_write_key(username))
     return value is not None
 
 
-async def set_refresh_token(
-    refresh_token: str, token_info_json: str, *, ex_seconds: int
-) -> None:
-    """Store refresh token payload in Redis."""
-    await get_redis().set(
-        refresh_token_key(refresh_token), token_info_json, ex=ex_seconds
+async def get_token_generation(username: str) -> int:
+    """Return the user's current token generation (0 until first bumped)."""
+    return int(await get_redis().get(token_generation_key(username)) or 0)
+
+
+# KEYS: the user's token generation
+# ARGV: generations channel, username, ttl seconds
+BUMP_TOKEN_GENERATION_SCRIPT = """
+local generation = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', ARGV[1], generation .. ':' .. ARGV[2])
+return generation
+"""
+
+
+async def bump_token_generation(username: str, *, ttl_seconds: int) -> int:
+    """
+    Revoke every access token issued to a user so far, with a single INCR, and
+    tell the other workers. Returns the new generation.
+    The key expires `ttl_seconds` after the bump, or after the last login or
+    refresh that read it, so only recently active users have one. The bump is
+    recorded for workers loading generations first, so none can miss it.
+    """
+    now = time.time()
+    lapses_at = now + ttl_seconds
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.zremrangebyscore(TOKEN_GENERATION_BUMPS_KEY, "-inf", now)
+        pipe.zadd(TOKEN_GENERATION_BUMPS_KEY, {username.lower(): lapses_at})
+        pipe.expireat(TOKEN_GENERATION_BUMPS_KEY, math.ceil(lapses_at))
+        await pipe.execute()
+
+    return await _script(BUMP_TOKEN_GENERATION_SCRIPT)(
+        keys=[token_generation_key(username)],
+        args=[TOKEN_GENERATIONS_CHANNEL, username.lower(), ttl_seconds],
     )
 
 
-async def delete_refresh_token(refresh_token: str) -> None:
-    """Delete a refresh token record from Redis."""
-    await get_redis().delete(refresh_token_key(refresh_token))
+async def recent_token_generations(batch_size: int = 1000):
+    """
+    Yield (username, generation, lapses_at) for every user whose generation was
+    bumped recently enough to still revoke a live access token.
+    """
+    bumps = await get_redis().zrangebyscore(
+        TOKEN_GENERATION_BUMPS_KEY, f"({time.time()}", "+inf", withscores=True
+    )
+    for start in range(0, len(bumps), batch_size):
+        batch = bumps[start : start + batch_size]
+        generations = await _get_token_generations([user for user, _ in batch])
+        for (username, lapses_at), generation in zip(batch, generations):
+            if generation:
+                yield username, generation, lapses_at
 
 
-async def add_user_refresh_token(
-    username: str, refresh_token: str, *, ex_seconds: int
-) -> None:
-    """Index a refresh token under a user for bulk revocation."""
-    key = user_refresh_tokens_key(username)
-    await get_redis().sadd(key, refresh_token)
-    await get_redis().expire(key, ex_seconds)
+async def _get_token_generations(usernames: list[str]) -> list[int]:
+    # keys are on different slots, so pipelined rather than one MGET
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for username in usernames:
+            pipe.get(token_generation_key(username))
+        values = await pipe.execute()
+    return [int(value or 0) for value in values]
 
 
-async def remove_user_refresh_token(username: str, refresh_token: str) -> None:
-    """Remove a refresh token from the user's index set."""
-    key = user_refresh_tokens_key(username)
-    await get_redis().srem(key, refresh_token)
+async def delete_refresh_token(username: str, refresh_token: str) -> None:
+    """Delete a refresh token record from Redis."""
+    await get_redis().delete(refresh_token_key(username, refresh_token))
+
+
+# shared by the refresh token scripts. a user's token index is a sorted set of
+# their refresh tokens scored by expiry time, so expired ones can be trimmed
+_TOKEN_INDEX_LUA = """
+-- indexes written before they were sorted sets are converted, scored by the
+-- set's own expiry, which is at least as late as any of its tokens'
+local function trimmed_index(key, now)
+    if redis.call('TYPE', key)['ok'] == 'set' then
+        local expires_at = now + math.max(redis.call('TTL', key), 0)
+        local tokens = redis.call('SMEMBERS', key)
+        redis.call('DEL', key)
+        for _, token in ipairs(tokens) do
+            redis.call('ZADD', key, expires_at, token)
+        end
+    end
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+end
+
+-- the token keys aren't declared in KEYS, but share the index's hash tag so are
+-- always on the same cluster node
+local function unlink_tokens(prefix, tokens)
+    local keys = {}
+    for i, token in ipairs(tokens) do
+        keys[#keys + 1] = prefix .. token
+        -- unpack() is limited in how many values it can return
+        if #keys == 1000 or i == #tokens then
+            redis.call('UNLINK', unpack(keys))
+            keys = {}
+        end
+    end
+end
+"""
+
+# KEYS: token, the user's token index, the user's token generation
+# ARGV: token payload, ttl seconds, token, now, max sessions, token key prefix,
+#       token generation ttl seconds
+STORE_USER_REFRESH_TOKEN_SCRIPT = (
+    _TOKEN_INDEX_LUA
+    + """
+local now = tonumber(ARGV[4])
+local expires_at = now + tonumber(ARGV[2])
+trimmed_index(KEYS[2], now)
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], expires_at, ARGV[3])
+
+-- past the cap, evict the sessions expiring soonest, i.e. the least recently used
+local evicted = redis.call('ZRANGE', KEYS[2], 0, -tonumber(ARGV[5]) - 1)
+if #evicted > 0 then
+    unlink_tokens(ARGV[6], evicted)
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, #evicted - 1)
+end
+
+redis.call('EXPIREAT', KEYS[2], math.ceil(expires_at))
+-- keep the generation for as long as the access token minted with it
+redis.call('EXPIRE', KEYS[3], ARGV[7])
+return tonumber(redis.call('GET', KEYS[3]) or 0)
+"""
+)
+
+
+async def store_user_refresh_token(
+    username: str,
+    refresh_token: str,
+    token_info_json: str,
+    *,
+    ex_seconds: int,
+    max_sessions: int,
+    generation_ttl_seconds: int,
+) -> int:
+    """
+    Store a refresh token payload and index it under the user, in one round trip.
+    Expired tokens are trimmed from the index, and if the user has more than
+    `max_sessions` tokens the oldest are revoked, so the index stays bounded.
+    Returns the user's token generation, to mint their access token with, and
+    keeps it for `generation_ttl_seconds`.
+    """
+    # pylint: disable=too-many-arguments
+    return await _script(STORE_USER_REFRESH_TOKEN_SCRIPT)(
+        keys=[
+            refresh_token_key(username, refresh_token),
+            user_refresh_tokens_key(username),
+            token_generation_key(username),
+        ],
+        args=[
+            token_info_json,
+            ex_seconds,
+            refresh_token,
+            time.time(),
+            max_sessions,
+            refresh_token_key(username, ""),
+            generation_ttl_seconds,
+        ],
+    )
 
 
-async def get_user_refresh_tokens(username: str) -> Any:
-    """Return the user's refresh token set members (type depends on Redis client)."""
+async def get_user_refresh_tokens(username: str) -> set[str]:
+    """Return the user's unexpired indexed refresh tokens."""
     key = user_refresh_tokens_key(username)
-    return await get_redis().smembers(key)
+    redis = get_redis()
+    try:
+        return set(await redis.zrangebyscore(key, f"({time.time()}", "+inf"))
+    except ResponseError as exc:
+        if not str(exc).startswith("WRONGTYPE"):
+            raise
+    # an index written before it was a sorted set, until the user's next login
+    # converts it
+    return set(await redis.smembers(key))
+
+
+# KEYS: the user's token index
+# ARGV: the user's refresh token key prefix
+REVOKE_USER_REFRESH_TOKENS_SCRIPT = (
+    _TOKEN_INDEX_LUA
+    + """
+local tokens
+if redis.call('TYPE', KEYS[1])['ok'] == 'set' then
+    tokens = redis.call('SMEMBERS', KEYS[1])
+else
+    tokens = redis.call('ZRANGE', KEYS[1], 0, -1)
+end
+unlink_tokens(ARGV[1], tokens)
+redis.call('UNLINK', KEYS[1])
+return #tokens
+"""
+)
+
+
+async def revoke_user_refresh_tokens(username: str) -> int:
+    """
+    Delete every refresh token indexed for a user, and the index, in one round
+    trip. Keys are UNLINKed so the memory is freed off the main thread.
+    Returns the number of tokens revoked.
+    """
+    return await _script(REVOKE_USER_REFRESH_TOKENS_SCRIPT)(
+        keys=[user_refresh_tokens_key(username)],
+        args=[refresh_token_key(username, "")],
+    )
 
 
-async def delete_user_refresh_tokens(username: str) -> None:
-    """Delete the user's refresh-token index key."""
-    key = user_refresh_tokens_key(username)
-    await get_redis().delete(key)
+# KEYS: old token, new token, the user's token index, the user's token generation
+# ARGV: username, new token payload, ttl seconds, old token, new token, now,
+#       token generation ttl seconds
+ROTATE_REFRESH_TOKEN_SCRIPT = (
+    _TOKEN_INDEX_LUA
+    + """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return false
+end
+
+local ok, info = pcall(cjson.decode, raw)
+if not ok or type(info) ~= 'table' or info['user'] ~= ARGV[1] or info['revoked'] then
+    return false
+end
+
+local now = tonumber(ARGV[6])
+local expires_at = now + tonumber(ARGV[3])
+redis.call('DEL', KEYS[1])
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+trimmed_index(KEYS[3], now)
+redis.call('ZREM', KEYS[3], ARGV[4])
+redis.call('ZADD', KEYS[3], expires_at, ARGV[5])
+redis.call('EXPIREAT', KEYS[3], math.ceil(expires_at))
+-- keep the generation for as long as the access token minted with it
+redis.call('EXPIRE', KEYS[4], ARGV[7])
+return tonumber(redis.call('GET', KEYS[4]) or 0)
+"""
+)
+
+
+async def rotate_refresh_token(
+    username: str,
+    refresh_token: str,
+    new_refresh_token: str,
+    new_token_info_json: str,
+    *,
+    ex_seconds: int,
+    generation_ttl_seconds: int,
+) -> int | None:
+    """
+    Replace a user's refresh token with a new one, atomically and in one round
+    trip, returning the user's token generation and keeping it for
+    `generation_ttl_seconds`. Returns None, changing nothing, if the old token
+    doesn't exist, is revoked or belongs to someone else, so concurrent refreshes
+    with the same token can't both succeed.
+    """
+    # pylint: disable=too-many-arguments
+    return await _script(ROTATE_REFRESH_TOKEN_SCRIPT)(
+        keys=[
+            refresh_token_key(username, refresh_token),
+            refresh_token_key(username, new_refresh_token),
+            user_refresh_tokens_key(username),
+            token_generation_key(username),
+        ],
+        args=[
+            username,
+            new_token_info_json,
+            ex_seconds,
+            refresh_token,
+            new_refresh_token,
+            time.time(),
+            generation_ttl_seconds,
+        ],
+    )
 
 
-async def get_refresh_token(refresh_token: str) -> Any:
+async def get_refresh_token(username: str, refresh_token: str) -> Any:
     """Return raw stored value for a refresh token key (or None).
 
     Return type is Any to avoid redis client Awaitable typing mismatch.
     """
-    return await get_redis().get(refresh_token_key(refresh_token))
+    return await get_redis().get(refresh_token_key(username, refresh_token))
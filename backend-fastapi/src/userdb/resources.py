@@ -0,0 +1,76 @@
+"""warm up shared resources at startup and release them at shutdown"""
+
+import asyncio
+import os
+from typing import Awaitable
+
+from userdb import db
+from userdb import redis as redis_store
+from userdb import revocations
+from userdb.utils import log
+
+_logger = log.get_logger(__name__)
+
+
+async def warm_up() -> None:
+    """
+    open db connections, connect to Redis and (if `WARMUP_AWS` is true) create
+    the AWS clients before serving, so requests right after a deploy are as fast
+    as later ones. failures are logged and don't stop startup.
+    then start following token revocations.
+    """
+    connections = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+    timeout = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
+
+    steps = {
+        "opening database connections": _warm_up_databases(connections),
+        "connecting to redis": redis_store.get_redis().ping(),
+    }
+    # off by default: loading boto3 costs every worker memory even if it only
+    # serves the users API
+    if os.getenv("WARMUP_AWS") == "true":
+        steps["creating aws clients"] = asyncio.to_thread(_warm_up_aws)
+
+    await asyncio.gather(
+        *(
+            _best_effort(description, step, timeout)
+            for description, step in steps.items()
+        )
+    )
+
+    # until it's following revocations the middleware checks tokens in Redis
+    revocations.cache.start()
+
+
+async def release() -> None:
+    """stop following revocations and close pooled db and Redis connections"""
+    await _best_effort("stopping the token generation cache", revocations.cache.stop())
+    await _best_effort("closing database connections", db.dispose_engines())
+    await _best_effort("closing redis connections", redis_store.close_redis())
+
+
+async def _warm_up_databases(connections: int) -> None:
+    await asyncio.gather(
+        *(
+            db.warm_up_pool(engine, connections)
+            for engine in [db.async_engine, *db.replica_engines]
+        )
+    )
+
+
+def _warm_up_aws() -> None:
+    # pylint: disable=import-outside-toplevel,protected-access
+    from userdb.aws import s3, sfn, ssm
+
+    s3._client()
+    sfn._client()
+    ssm.prefetch_parameters()
+
+
+async def _best_effort(
+    description: str, step: Awaitable, timeout: float | None = None
+) -> None:
+    try:
+        await asyncio.wait_for(step, timeout)
+    except Exception:  # pylint: disable=broad-exception-caught
+        _logger.exception("%s failed, continuing", description)
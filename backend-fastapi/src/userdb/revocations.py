@@ -0,0 +1,146 @@
+"""
+In-process cache of per-user token generations.
+
+Logging out bumps the user's token generation in Redis, which revokes every
+access token minted with an older one. Those all expire within the access token
+lifetime, so a generation only matters for that long after a bump, and each
+worker keeps just the recent ones: loaded from Redis at startup and kept current
+from the generations pub/sub channel, checks need no round trip. Until the
+subscription is live, and while it's reconnecting, every check goes to Redis.
+"""
+
+import asyncio
+import time
+
+from userdb import redis as redis_store
+from userdb.utils import auth, log
+
+_logger = log.get_logger(__name__)
+
+RECONNECT_SECONDS = 1.0
+# pubsub.listen() would block on the socket timeout and drop an idle subscription,
+# so messages are polled with their own timeout instead
+POLL_SECONDS = 5.0
+# how often lapsed generations are dropped from the cache
+EVICT_SECONDS = 60.0
+
+
+class GenerationCache:
+    """Token generation of each user who has logged out recently, synced from Redis."""
+
+    def __init__(self):
+        self.ready = False
+        # username -> (generation, when it can no longer revoke a live token)
+        self._generations: dict[str, tuple[int, float]] = {}
+        self._task: asyncio.Task | None = None
+
+    def get(self, username: str) -> int:
+        """the user's token generation, or 0 once it has lapsed"""
+        generation, lapses_at = self._generations.get(username.lower(), (0, 0.0))
+        return generation if lapses_at > time.time() else 0
+
+    def update(self, username: str, generation: int, lapses_at: float) -> None:
+        """
+        record a user's generation until `lapses_at`. while it's live a generation
+        only goes up, so stale updates are ignored
+        """
+        username = username.lower()
+        current, current_lapses_at = self._generations.get(username, (0, 0.0))
+        if current_lapses_at > time.time():
+            if generation < current:
+                return
+            if generation == current:
+                lapses_at = max(lapses_at, current_lapses_at)
+        self._generations[username] = (generation, lapses_at)
+
+    def evict_lapsed(self) -> None:
+        """drop generations that can no longer revoke a live token"""
+        now = time.time()
+        lapsed = [
+            username
+            for username, (_, lapses_at) in self._generations.items()
+            if lapses_at <= now
+        ]
+        for username in lapsed:
+            del self._generations[username]
+
+    def start(self) -> None:
+        """start following generations in the background"""
+        if not self._task:
+            self._task = asyncio.create_task(self._follow())
+
+    async def stop(self) -> None:
+        """stop following generations"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.ready = False
+
+    async def _follow(self) -> None:
+        while True:
+            try:
+                await self._subscribe_and_listen()
+            except Exception:  # pylint: disable=broad-exception-caught
+                _logger.exception("token generation subscription lost, reconnecting")
+            finally:
+                self.ready = False
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _subscribe_and_listen(self) -> None:
+        pubsub = redis_store.pubsub()
+        try:
+            # subscribe before loading existing generations, so no bump is missed
+            await pubsub.subscribe(redis_store.TOKEN_GENERATIONS_CHANNEL)
+            generations = redis_store.recent_token_generations()
+            async for username, generation, lapses_at in generations:
+                self.update(username, generation, lapses_at)
+            self.ready = True
+
+            evict_at = time.monotonic() + EVICT_SECONDS
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=POLL_SECONDS
+                )
+                if message and message["type"] == "message":
+                    generation, _, username = message["data"].partition(":")
+                    self.update(username, int(generation), _lapses_at())
+                if time.monotonic() >= evict_at:
+                    self.evict_lapsed()
+                    evict_at = time.monotonic() + EVICT_SECONDS
+        finally:
+            await pubsub.aclose()
+
+
+def _lapses_at() -> float:
+    # when a generation bumped now stops mattering
+    return time.time() + auth.TOKEN_GENERATION_TTL_SECONDS
+
+
+cache = GenerationCache()
+
+
+async def is_revoked(payload: dict) -> bool:
+    """Return True if a verified access token's generation has been revoked."""
+    username = payload["sub"]
+    if cache.ready:
+        generation = cache.get(username)
+    else:
+        generation = await redis_store.get_token_generation(username)
+    # tokens from before generations were added don't have one
+    return payload.get("gen", 0) < generation
+
+
+async def revoke_all(username: str) -> None:
+    """
+    Revoke every access token issued to the user so far.
+    Other workers hear about it over pub/sub; this one is updated immediately so
+    the client's next request can't beat the message back.
+    """
+    generation = await redis_store.bump_token_generation(
+        username, ttl_seconds=auth.TOKEN_GENERATION_TTL_SECONDS
+    )
+    cache.update(username, generation, _lapses_at())
@@ -1,7 +1,6 @@
 """auth http handlers"""
 
 import json
-import time
 from datetime import datetime, timezone
 from json import JSONDecodeError
 
@@ -12,6 +11,7 @@ import jwt
 
 from userdb.utils import auth
 from userdb import redis as redis_store
+from userdb import revocations
 from userdb.utils import log
 
 _logger = log.get_logger(__name__)
@@ -85,17 +85,19 @@ async def login(
         "user": username_lower,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    # Store refresh token and index it for the user
-    await redis_store.set_refresh_token(
+    # Store refresh token and index it for the user, in one round trip
+    generation = await redis_store.store_user_refresh_token(
+        username_lower,
         refresh_token,
         json.dumps(token_info),
         ex_seconds=auth.REFRESH_TOKEN_EXPIRE_SECONDS,
-    )
-    await redis_store.add_user_refresh_token(
-        username_lower, refresh_token, ex_seconds=auth.REFRESH_TOKEN_EXPIRE_SECONDS
+        max_sessions=auth.MAX_REFRESH_SESSIONS,
+        generation_ttl_seconds=auth.TOKEN_GENERATION_TTL_SECONDS,
     )
 
-    access_token = auth.create_access_token(subject=username_lower)
+    access_token = auth.create_access_token(
+        subject=username_lower, generation=generation
+    )
 
     resp = _access_token_response(access_token)
     _set_refresh_cookie(resp, refresh_token)
@@ -108,44 +110,29 @@ async def refresh(refresh_token: str | None = Cookie(default=None)):
     if not refresh_token:
         raise HTTPException(status_code=401)
 
-    token_info_raw = await redis_store.get_refresh_token(refresh_token)
-    if not token_info_raw:
-        raise HTTPException(status_code=401)
-
-    try:
-        token_info = json.loads(token_info_raw)
-    except (JSONDecodeError, TypeError) as exc:
-        raise HTTPException(status_code=401) from exc
-
-    if token_info.get("revoked"):
-        raise HTTPException(status_code=401)
-
-    username = token_info.get("user")
+    username = auth.refresh_token_user(refresh_token)
     if not username:
         raise HTTPException(status_code=401)
-    new_token = auth.create_refresh_token(user_id=username)
-
-    # Maintain per-user refresh token index
-    # Maintain per-user refresh token index (remove old, add new)
-    await redis_store.remove_user_refresh_token(username, refresh_token)
-    await redis_store.add_user_refresh_token(
-        username, new_token, ex_seconds=auth.REFRESH_TOKEN_EXPIRE_SECONDS
-    )
 
+    new_token = auth.create_refresh_token(user_id=username)
     new_token_info = {
         "user": username,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    await redis_store.set_refresh_token(
+
+    # validate, swap and re-index in one atomic step, so a token can't be used twice
+    generation = await redis_store.rotate_refresh_token(
+        username,
+        refresh_token,
         new_token,
         json.dumps(new_token_info),
         ex_seconds=auth.REFRESH_TOKEN_EXPIRE_SECONDS,
+        generation_ttl_seconds=auth.TOKEN_GENERATION_TTL_SECONDS,
     )
+    if generation is None:
+        raise HTTPException(status_code=401)
 
-    # Delete the old refresh token after rotation completes successfully.
-    await redis_store.delete_refresh_token(refresh_token)
-
-    access_token = auth.create_access_token(subject=username)
+    access_token = auth.create_access_token(subject=username, generation=generation)
     response = _access_token_response(access_token)
     _set_refresh_cookie(response, new_token)
     return response
@@ -156,11 +143,12 @@ async def logout(
     request: Request,
     refresh_token: str | None = Cookie(default=None),
 ):
-    """Logout revokes refresh tokens and the presented access token.
+    """Logout revokes all of the user's refresh and access tokens.
 
     - If a refresh cookie exists: revoke that cookie token.
-    - If an Authorization bearer access token exists: mark it revoked in Redis until exp.
-    - If a username can be determined: revoke all refresh tokens indexed for that user.
+    - The user comes from the cookie's token info, else the bearer access token.
+    - If a username can be determined: revoke all refresh tokens indexed for that
+      user, and bump their token generation to revoke all their access tokens.
     """
 
     # Use redis helpers for token operations
@@ -169,8 +157,9 @@ async def logout(
     username: str | None = None
 
     # Best-effort: if we still have refresh token info, extract username for bulk revoke.
-    if refresh_token:
-        raw = redis_store.get_refresh_token(refresh_token)
+    token_user = auth.refresh_token_user(refresh_token) if refresh_token else None
+    if refresh_token and token_user:
+        raw = await redis_store.get_refresh_token(token_user, refresh_token)
         if isinstance(raw, str) and raw:
             try:
                 username = (json.loads(raw) or {}).get("user")
@@ -178,37 +167,25 @@ async def logout(
                 username = None
 
         # Revoke the cookie refresh token.
-        await redis_store.delete_refresh_token(refresh_token)
+        await redis_store.delete_refresh_token(token_user, refresh_token)
 
-    # Revoke the presented access token.
+    # Otherwise the presented access token identifies the user.
     auth_header = request.headers.get("authorization") or ""
     access_token: str | None = None
     if auth_header.lower().startswith("bearer "):
         access_token = auth_header.split(" ", 1)[1].strip()
 
-    if access_token:
+    if access_token and not username:
         payload = _decode_access_token_allow_expired(access_token)
         if payload and payload.get("type") == auth.CLAIM_TYPE_ACCESS:
-            # Determine username (for bulk refresh revoke) + TTL for revocation entry.
             sub = payload.get("sub")
             if isinstance(sub, str) and sub:
-                username = username or sub
-
-            exp = payload.get("exp")
-            if isinstance(exp, (int, float)):
-                ttl = int(exp - time.time())
-                await redis_store.revoke_access_token(access_token, ttl_seconds=ttl)
-            else:
-                # Fallback: if exp missing/unexpected, revoke for a short window.
-                await redis_store.revoke_access_token(access_token, ttl_seconds=60)
+                username = sub
 
-    # Bulk revoke any other refresh tokens for the user.
+    # Bulk revoke the user's other refresh tokens and all their access tokens.
     if username:
-        tokens = await redis_store.get_user_refresh_tokens(username)
-        for t in tokens:
-            if isinstance(t, str) and t:
-                await redis_store.delete_refresh_token(t)
-        await redis_store.delete_user_refresh_tokens(username)
+        await redis_store.revoke_user_refresh_tokens(username)
+        await revocations.revoke_all(username)
     resp = Response(status_code=204)
     _clear_refresh_cookie(resp)
     return resp
@@ -0,0 +1,44 @@
+"""runtime metrics http handlers"""
+
+from fastapi import APIRouter
+
+from userdb import db
+from userdb import redis as redis_store
+from userdb.models.metrics import DbPoolStats, RedisStats
+from userdb.utils.auth import require_admin
+
+router = APIRouter(prefix="/metrics", dependencies=[require_admin])
+
+
+@router.get(
+    "/db-pool",
+    response_model=DbPoolStats,
+    summary="Connection pool statistics for the worker serving the request",
+)
+async def get_db_pool_stats():
+    """live pool usage and checkout wait times, for sizing the pool per worker"""
+    return db.pool_stats(db.async_engine)
+
+
+@router.get(
+    "/db-replica-pools",
+    response_model=list[DbPoolStats],
+    summary="Connection pool statistics for each read replica",
+)
+async def get_db_replica_pool_stats():
+    """live pool usage per replica engine, in `POSTGRES_REPLICA_HOSTS` order"""
+    return [db.pool_stats(engine) for engine in db.replica_engines]
+
+
+@router.get(
+    "/redis",
+    response_model=RedisStats,
+    summary="Redis pool and command latency statistics",
+)
+async def get_redis_stats():
+    """
+    pool usage, connection wait times and per command latency for the worker
+    serving the request. pipelines are counted as one MULTI or PIPELINE command
+    and Lua scripts as EVALSHA.
+    """
+    return redis_store.redis_stats()
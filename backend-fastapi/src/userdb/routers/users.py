@@ -1,29 +1,415 @@
 """user http handlers"""
 
-from typing import Annotated
+from collections import Counter
+import csv
+from datetime import date, datetime
+import hashlib
+import io
+import os
+from typing import Annotated, Any, AsyncIterator, Iterable
 import uuid
-from fastapi import APIRouter, Body, Path, Request, status
-from sqlmodel import select
+from fastapi import (
+    APIRouter,
+    Body,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from redis.exceptions import RedisError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import Row, Select
+from sqlmodel import case, insert, select, tuple_, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from userdb.db import SessionDep
-from userdb.models.user import User, UserCreate, UserPublic
-from userdb.utils.auth import require_admin
+from userdb import db
+from userdb import redis as redis_store
+from userdb.db import AsyncSessionDep, ReadSessionDep
+from userdb.models.stats import UserAgeBand, UserBirthYearCount, UserStats
+from userdb.models.user import (
+    User,
+    UserBulkCreateError,
+    UserBulkCreateResult,
+    UserBulkDeleteResult,
+    UserCreate,
+    UserExportFormat,
+    UserPublic,
+    UserPublicRow,
+    UserSort,
+    user_search_name,
+)
+from userdb.utils import log, search
+from userdb.utils.auth import CURRENT_USER, CurrentUser, require_admin
+from userdb.utils.pagination import decode_cursor, encode_cursor
 
 router = APIRouter()
 
+_logger = log.get_logger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_BULK_CREATE_USERS = 5000
+MAX_BULK_DELETE_USERS = 5000
+EXPORT_BATCH_SIZE = 1000
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# (min, max) ages reported by /users/stats, open ended if max is None
+AGE_BANDS = [(16, 24), (25, 34), (35, 44), (45, 54), (55, 64), (65, None)]
+USERS_CACHE_TTL_SECONDS = int(os.getenv("USERS_CACHE_TTL_SECONDS", "300"))
+
+# UserPublic columns, in field order
+PUBLIC_COLUMNS = [getattr(User, name) for name in UserPublic.model_fields]
+
+_USER_JSON = TypeAdapter(UserPublicRow)
+_USERS_JSON = TypeAdapter(list[UserPublicRow])
+
+_EXPORT_MEDIA_TYPES = {
+    UserExportFormat.NDJSON: "application/x-ndjson",
+    UserExportFormat.CSV: "text/csv",
+}
+
+
+def users_json(rows: Iterable[Row]) -> bytes:
+    """
+    serialize rows of `PUBLIC_COLUMNS` (other columns are left out) as a JSON
+    array of UserPublic, without building a model per row
+    """
+    return _USERS_JSON.dump_json([row._asdict() for row in rows], by_alias=True)
+
+
+def list_users_query(
+    *, sort: UserSort, after: tuple[datetime, uuid.UUID] | None = None
+) -> Select:
+    """
+    select the public columns and created_at of active users in `sort` order,
+    starting after the (created_at, id) key `after` if given. matches the
+    ix_user_active_created_at_id partial index.
+    """
+    # pylint: disable=singleton-comparison
+
+    descending = sort == UserSort.CREATED_AT_DESC
+    sort_key = tuple_(User.created_at, User.id)
+
+    statement = select(*PUBLIC_COLUMNS, User.created_at).where(User.deleted == False)
+
+    if after:
+        statement = statement.where(
+            sort_key < after if descending else sort_key > after
+        )
+
+    if descending:
+        # pylint: disable-next=no-member
+        return statement.order_by(User.created_at.desc(), User.id.desc())  # type: ignore
+
+    return statement.order_by(User.created_at, User.id)
+
 
 @router.get(
     "/users",
     response_model=list[UserPublic],
     summary="Return all users from the database",
 )
-async def get_all_users(session: SessionDep, *, request: Request):
-    """get all non-deleted users"""
-    # pylint: disable=singleton-comparison
+async def get_all_users(
+    session: ReadSessionDep,
+    primary_session: AsyncSessionDep,
+    *,
+    request: Request,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    cursor: Annotated[str | None, Query()] = None,
+    sort: Annotated[UserSort, Query()] = UserSort.CREATED_AT,
+):
+    """
+    get a page of non-deleted users.
+    pages are keyed on (created_at, id); when there are more results the cursor
+    for the next page is returned in the `X-Next-Cursor` header.
+    serialized pages are cached in Redis under the current users list version,
+    which their ETag is derived from.
+    """
+    # pylint: disable=too-many-arguments
 
     print("Request made by user:", request.state.user)
 
-    return session.exec(select(User).where(User.deleted == False)).all()
+    after = _users_cursor_key(cursor) if cursor else None
+
+    etag, cache_key, cached = await _cached_users_page(
+        f"{sort}:{limit}:{cursor or ''}", request.headers.get("if-none-match")
+    )
+    if cached:
+        return cached
+
+    if cache_key:
+        # a lagging replica can return a page from before the current version.
+        # caching it would serve it to everyone, the writer included, and tagging
+        # it would let clients revalidate the stale body against the new version.
+        # the cache takes the load off the db instead
+        session = primary_session
+
+    statement = list_users_query(sort=sort, after=after)
+
+    # fetch one extra row to find out if there's another page
+    users = (await session.exec(statement.limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat(), str(last.id))
+
+    body = users_json(users).decode()
+
+    if cache_key:
+        try:
+            await redis_store.set_cached_users_page(
+                cache_key,
+                f"{next_cursor or ''}\n{body}",
+                ex_seconds=USERS_CACHE_TTL_SECONDS,
+            )
+        except RedisError:
+            _logger.exception("failed to cache users list page")
+
+    return _users_page_response(body, next_cursor, etag)
+
+
+def _users_cursor_key(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """the (created_at, id) key a users list page continues after"""
+    created_at, user_id = decode_cursor(cursor, size=2)
+    try:
+        return datetime.fromisoformat(created_at), uuid.UUID(user_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        ) from exc
+
+
+async def _cached_users_page(
+    page: str, if_none_match: str | None
+) -> tuple[str | None, str | None, Response | None]:
+    """
+    look up a users list page in the cache.
+    returns the page's ETag and cache key, both None if Redis is unavailable, and
+    the response to send if the client's copy is current or the page is cached.
+    """
+    try:
+        version = await redis_store.get_users_list_version()
+
+        etag = _users_page_etag(version, page)
+        if _etag_matches(if_none_match, etag):
+            return etag, None, _users_page_response(None, None, etag)
+
+        cache_key = redis_store.users_list_page_key(version, page)
+        cached = await redis_store.get_cached_users_page(cache_key)
+    except RedisError:
+        _logger.exception("users list cache unavailable")
+        return None, None, None
+
+    if not cached:
+        return etag, cache_key, None
+
+    next_cursor, body = cached.split("\n", 1)
+    return etag, cache_key, _users_page_response(body, next_cursor or None, etag)
+
+
+def _users_page_etag(version: str, page: str) -> str:
+    """
+    users list ETag. a page's content only changes when the list version does, so
+    the version and page parameters identify it without hashing the body.
+    """
+    page_hash = hashlib.blake2b(page.encode("utf-8"), digest_size=8).hexdigest()
+    return f'"{version}-{page_hash}"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+def _users_page_response(
+    body: str | None, next_cursor: str | None, etag: str | None
+) -> Response:
+    """
+    users list page response, or 304 Not Modified without a body.
+    clients must revalidate every time as the ETag only changes with the data.
+    """
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    if body is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def _users_changed(current_user: CurrentUser) -> None:
+    """bookkeeping after a committed write to users"""
+    await db.record_write(current_user.username)
+    try:
+        await redis_store.bump_users_list_version()
+    except RedisError:
+        # cached pages will be stale until they expire
+        _logger.exception("failed to invalidate users list cache")
+
+
+async def _adjust_birth_year_counts(
+    session: AsyncSession, dates_of_birth: Iterable[date], sign: int
+) -> None:
+    """
+    add (sign=1) or remove (sign=-1) users from the stats counts, as part of the
+    caller's transaction
+    """
+    changes = Counter(dob.year for dob in dates_of_birth)
+    if not changes:
+        return
+
+    bind = session.bind  # type: ignore[union-attr]
+    dialect = postgresql if bind.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(UserBirthYearCount).values(
+        # sorted so concurrent writers lock rows in the same order
+        [
+            {"birth_year": year, "count": sign * count}
+            for year, count in sorted(changes.items())
+        ]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserBirthYearCount.birth_year],
+        set_={"count": UserBirthYearCount.count + statement.excluded.count},
+    )
+    await session.exec(statement)  # type: ignore
+
+
+def _csv_lines(*rows) -> str:
+    """format rows as CSV text"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+@router.get(
+    "/users/export",
+    summary="Stream all users as NDJSON or CSV",
+    dependencies=[require_admin],
+    response_class=StreamingResponse,
+)
+async def export_users(
+    session: ReadSessionDep,
+    export_format: Annotated[
+        UserExportFormat, Query(alias="format")
+    ] = UserExportFormat.NDJSON,
+):
+    """
+    Export every non-deleted user.
+    Rows are read from a server-side cursor in batches of `EXPORT_BATCH_SIZE` and
+    written out as they arrive, so memory use doesn't grow with the table.
+    """
+    # pylint: disable=singleton-comparison
+
+    statement = (
+        select(*PUBLIC_COLUMNS)
+        .where(User.deleted == False)
+        .order_by(User.created_at, User.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    async def rows() -> AsyncIterator[str | bytes]:
+        result = await session.stream(statement)
+
+        if export_format == UserExportFormat.CSV:
+            yield _csv_lines(
+                [field.alias or name for name, field in UserPublic.model_fields.items()]
+            )
+
+        async for partition in result.partitions():
+            if export_format == UserExportFormat.CSV:
+                yield _csv_lines(*partition)
+            else:
+                yield b"".join(
+                    _USER_JSON.dump_json(row._asdict(), by_alias=True) + b"\n"
+                    for row in partition
+                )
+
+    return StreamingResponse(
+        rows(),
+        media_type=_EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="users.{export_format}"'
+        },
+    )
+
+
+@router.get(
+    "/users/stats",
+    response_model=UserStats,
+    summary="Count active users, in total and by age band",
+)
+async def get_user_stats(session: ReadSessionDep):
+    """
+    active user counts.
+    read from the per birth year counts kept by the write handlers, so the cost
+    doesn't grow with the number of users. ages are as of this year's birthday.
+    """
+    bands = [UserAgeBand(min_age=low, max_age=high, count=0) for low, high in AGE_BANDS]
+    this_year = date.today().year
+
+    for row in (await session.exec(select(UserBirthYearCount))).all():
+        age = this_year - row.birth_year
+        band = next((b for b in reversed(bands) if age >= b.min_age), bands[0])
+        band.count += row.count
+
+    return UserStats(total=sum(band.count for band in bands), age_bands=bands)
+
+
+@router.get(
+    "/users/search",
+    response_model=list[UserPublic],
+    summary="Search users by name",
+)
+async def search_users(
+    session: ReadSessionDep,
+    q: Annotated[str, Query(min_length=1, max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=MAX_SEARCH_LIMIT)] = DEFAULT_SEARCH_LIMIT,
+):
+    """
+    find non-deleted users whose "firstname lastname" contains `q`, ignoring case
+    and accents. names starting with `q` are listed first.
+    on postgres the match uses the ix_user_active_name_trgm trigram index.
+    """
+    # pylint: disable=singleton-comparison
+
+    term = search.fold(q.strip())
+    if not term:
+        return Response(content=b"[]", media_type="application/json")
+
+    name = search.folded(user_search_name())
+    statement = (
+        select(*PUBLIC_COLUMNS)
+        .where(
+            User.deleted == False,
+            name.like(search.like_contains(term), escape="\\"),
+        )
+        .order_by(
+            case((name.like(search.like_prefix(term), escape="\\"), 0), else_=1),
+            User.lastname,
+            User.firstname,
+            User.id,
+        )
+        .limit(limit)
+    )
+
+    rows = (await session.exec(statement)).all()
+    return Response(content=users_json(rows), media_type="application/json")
 
 
 @router.post(
@@ -34,18 +420,73 @@ async def get_all_users(session: SessionDep, *, request: Request):
 )
 async def create_user(
     user: Annotated[UserCreate, Body(embed=True)],
-    session: SessionDep,
+    session: AsyncSessionDep,
+    current_user: CurrentUser = CURRENT_USER,
 ):
     """
     Create a user
     """
-    db_user = User.model_validate(user)
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    # INSERT ... RETURNING rather than add/commit/refresh, saving a SELECT
+    statement = (
+        insert(User).values(User.model_validate(user).model_dump()).returning(User)
+    )
+    db_user = (await session.exec(statement)).scalars().one()  # type: ignore
+    await _adjust_birth_year_counts(session, [db_user.date_of_birth], 1)
+    await session.commit()
+    await _users_changed(current_user)
     return db_user
 
 
+@router.post(
+    "/users/bulk",
+    response_model=UserBulkCreateResult,
+    summary="Create many users in a single transaction",
+    dependencies=[require_admin],
+)
+async def bulk_create_users(
+    users: Annotated[list[Any], Body(embed=True, max_length=MAX_BULK_CREATE_USERS)],
+    session: AsyncSessionDep,
+    current_user: CurrentUser = CURRENT_USER,
+):
+    """
+    Create users from a list of `UserCreate` rows.
+    Valid rows are inserted together with one multi-row insert; invalid rows are
+    reported by index in `errors` and don't stop the rest of the batch.
+    """
+    errors: list[UserBulkCreateError] = []
+    rows: list[dict[str, Any]] = []
+
+    for index, data in enumerate(users):
+        try:
+            rows.append(
+                User.model_validate(UserCreate.model_validate(data)).model_dump()
+            )
+        except ValidationError as exc:
+            errors.append(
+                UserBulkCreateError(
+                    index=index,
+                    detail=jsonable_encoder(exc.errors(include_url=False)),
+                )
+            )
+        except HTTPException as exc:
+            errors.append(UserBulkCreateError(index=index, detail=exc.detail))
+
+    created: list[User] = []
+    if rows:
+        statement = insert(User).returning(User, sort_by_parameter_order=True)
+        created = list((await session.exec(statement, params=rows)).scalars())  # type: ignore
+        await _adjust_birth_year_counts(
+            session, (user.date_of_birth for user in created), 1
+        )
+        await session.commit()
+        await _users_changed(current_user)
+
+    return UserBulkCreateResult(
+        created=[UserPublic.model_validate(user) for user in created],
+        errors=errors,
+    )
+
+
 @router.delete(
     "/user/{user_id}",
     summary="Delete the specified user id",
@@ -54,16 +495,60 @@ async def create_user(
 )
 async def delete_user(
     user_id: Annotated[uuid.UUID, Path(title="The ID of the user to delete")],
-    session: SessionDep,
+    session: AsyncSessionDep,
+    current_user: CurrentUser = CURRENT_USER,
 ):
     """soft deletes a user"""
-    statement = select(User).where(User.id == user_id)
-    results = session.exec(statement)
-    user = results.first()
+    # pylint: disable=singleton-comparison
+
+    statement = (
+        update(User)
+        .where(User.id == user_id, User.deleted == False)
+        .values(deleted=True)
+        .returning(User.date_of_birth)
+    )
+    deleted = (await session.exec(statement)).first()  # type: ignore
 
-    if not user:
+    if not deleted:
         # probably deleted by someone else but would add logging
         return
 
-    user.deleted = True
-    session.commit()
+    await _adjust_birth_year_counts(session, [deleted.date_of_birth], -1)
+    await session.commit()
+    await _users_changed(current_user)
+
+
+@router.post(
+    "/users/bulk-delete",
+    response_model=UserBulkDeleteResult,
+    summary="Delete many users in a single statement",
+    dependencies=[require_admin],
+)
+async def bulk_delete_users(
+    ids: Annotated[list[uuid.UUID], Body(embed=True, max_length=MAX_BULK_DELETE_USERS)],
+    session: AsyncSessionDep,
+    current_user: CurrentUser = CURRENT_USER,
+):
+    """
+    soft deletes users with one UPDATE.
+    only ids of users that were deleted by this request are returned; unknown and
+    already deleted ids are ignored.
+    """
+    # pylint: disable=singleton-comparison,no-member
+
+    statement = (
+        update(User)
+        .where(User.id.in_(ids), User.deleted == False)  # type: ignore[attr-defined]
+        .values(deleted=True)
+        .returning(User.id, User.date_of_birth)
+    )
+    deleted = (await session.exec(statement)).all()  # type: ignore
+
+    if deleted:
+        await _adjust_birth_year_counts(
+            session, (row.date_of_birth for row in deleted), -1
+        )
+        await session.commit()
+        await _users_changed(current_user)
+
+    return UserBulkDeleteResult(deleted=[row.id for row in deleted])
@@ -0,0 +1,73 @@
+"""
+production server entry point, run with `python -m userdb.serve`.
+starts `WEB_CONCURRENCY` uvicorn worker processes (default one per available
+CPU) behind a single socket.
+"""
+
+import importlib.util
+import os
+from typing import Any
+
+import uvicorn
+
+from userdb import db
+from userdb.utils import log
+
+_logger = log.get_logger(__name__)
+
+APP = "userdb.main:app"
+
+# set for worker processes once the parent has initialised the db
+SKIP_INIT_DB_ENV = "USERDB_SKIP_INIT_DB"
+
+
+def worker_count() -> int:
+    """`$WEB_CONCURRENCY`, or the number of CPUs this process may use"""
+    if workers := os.getenv("WEB_CONCURRENCY"):
+        return max(int(workers), 1)
+    return os.process_cpu_count() or 1
+
+
+def server_options() -> dict[str, Any]:
+    """uvicorn settings from env, preferring uvloop and httptools if installed"""
+    return {
+        "host": os.getenv("HOST", "0.0.0.0"),
+        "port": int(os.getenv("PORT", "80")),
+        "workers": worker_count(),
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        # queued connections per socket before the kernel refuses new ones
+        "backlog": int(os.getenv("SERVER_BACKLOG", "2048")),
+        # longer than load balancer idle timeouts (60s on AWS ALBs), so the
+        # balancer closes idle connections rather than racing us to
+        "timeout_keep_alive": int(os.getenv("SERVER_KEEP_ALIVE_SECONDS", "75")),
+        # time in-flight requests get to finish on SIGTERM before workers exit
+        "timeout_graceful_shutdown": int(
+            os.getenv("SERVER_GRACEFUL_SHUTDOWN_SECONDS", "30")
+        ),
+        "proxy_headers": True,
+        "forwarded_allow_ips": os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        "log_level": os.getenv("LOG_LEVEL", "INFO").lower(),
+    }
+
+
+def main() -> None:
+    """initialise the db once, then serve the app from worker processes"""
+    options = server_options()
+
+    # workers would otherwise all run init_db at the same time on startup
+    db.init_db()
+    db.engine.dispose()
+    os.environ[SKIP_INIT_DB_ENV] = "true"
+
+    _logger.info(
+        "starting %s workers (%s, %s)",
+        options["workers"],
+        options["loop"],
+        options["http"],
+    )
+    uvicorn.run(APP, **options)
+
+
+if __name__ == "__main__":
+    main()
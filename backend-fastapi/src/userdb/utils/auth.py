@@ -10,7 +10,12 @@ from fastapi import Depends, HTTPException, Request
 import jwt
 
 REFRESH_TOKEN_EXPIRE_SECONDS = 3600 * 6
+# logging in again past this many sessions revokes the least recently used one
+MAX_REFRESH_SESSIONS = max(1, int(os.environ.get("MAX_REFRESH_SESSIONS", "10")))
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
+# a user's token generation is kept while any access token minted with or revoked
+# by it can be live, plus a minute for tokens minted just after reading it
+TOKEN_GENERATION_TTL_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60 + 60
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "dev-secret")
 JWT_ALGORITHM = "HS256"
 CLAIM_TYPE_ACCESS = "access"
@@ -37,12 +42,31 @@ def create_refresh_token(user_id: str) -> str:
     return f"refresh-{user_id}-{uuid.uuid4()}"
 
 
+def refresh_token_user(refresh_token: str) -> str | None:
+    """Return the user id a refresh token was created for, or None if malformed."""
+
+    body = refresh_token.removeprefix("refresh-")
+    user_id, token_id = body[:-37], body[-36:]
+    if body == refresh_token or not user_id or body[-37:-36] != "-":
+        return None
+
+    try:
+        uuid.UUID(token_id)
+    except ValueError:
+        return None
+    return user_id
+
+
 def create_access_token(
     *,
     subject: str,
+    generation: int = 0,
     extra_claims: dict[str, Any] | None = None,
 ) -> str:
-    """Create a signed short-lived access JWT."""
+    """
+    Create a signed short-lived access JWT.
+    `generation` is the user's token generation, bumping it revokes the token.
+    """
 
     now = datetime.now(timezone.utc)
 
@@ -51,6 +75,8 @@ def create_access_token(
         "iat": now,
         "exp": now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
         "type": CLAIM_TYPE_ACCESS,
+        "jti": uuid.uuid4().hex,
+        "gen": generation,
     }
 
     if extra_claims:
@@ -0,0 +1,69 @@
+"""Case and accent insensitive text matching."""
+
+import unicodedata
+
+from sqlalchemy import String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+# name of the sqlite function registered by userdb.db for `folded` on sqlite
+SQLITE_FOLD_FUNCTION = "userdb_fold"
+
+# letters that don't decompose into a base letter + accent, mapped the same way
+# as postgres' unaccent extension
+_UNDECOMPOSED = str.maketrans(
+    {
+        "æ": "ae",
+        "ð": "d",
+        "đ": "d",
+        "ł": "l",
+        "ø": "o",
+        "œ": "oe",
+        "þ": "th",
+    }
+)
+
+
+def fold(value: str) -> str:
+    """lowercase and strip accents, e.g. "Zoë Ødegård" -> "zoe odegard" """
+    decomposed = unicodedata.normalize("NFKD", value.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return stripped.translate(_UNDECOMPOSED)
+
+
+def like_contains(value: str) -> str:
+    """LIKE pattern matching `value` anywhere, escaped with backslash"""
+    return f"%{_escape_like(value)}%"
+
+
+def like_prefix(value: str) -> str:
+    """LIKE pattern matching values starting with `value`, escaped with backslash"""
+    return f"{_escape_like(value)}%"
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class folded(FunctionElement):  # pylint: disable=invalid-name,too-many-ancestors
+    """SQL equivalent of `fold` for a text expression"""
+
+    type = String()
+    inherit_cache = True
+
+
+@compiles(folded, "postgresql")
+def _compile_folded_postgresql(element, compiler, **kw):
+    # f_unaccent is an IMMUTABLE wrapper of unaccent created by init_db, so it can
+    # be used in index expressions
+    return f"f_unaccent(lower({compiler.process(element.clauses, **kw)}))"
+
+
+@compiles(folded, "sqlite")
+def _compile_folded_sqlite(element, compiler, **kw):
+    return f"{SQLITE_FOLD_FUNCTION}({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(folded)
+def _compile_folded(element, compiler, **kw):
+    return f"lower({compiler.process(element.clauses, **kw)})"
@@ -4,6 +4,9 @@
 
 import asyncio
 import dataclasses
+import functools
+import json
+import math
 import os
 import time
 from unittest import mock
@@ -12,12 +15,16 @@ import boto3
 from fastapi.testclient import TestClient
 import moto
 import pytest
+from redis.exceptions import ResponseError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session, SQLModel, create_engine, delete
-from sqlmodel.pool import StaticPool
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from userdb.utils import auth
-from userdb.db import get_session
+from userdb.db import get_async_session, get_read_session, get_session
 from userdb.main import app as fastapi_app
+from userdb.models.stats import UserBirthYearCount
 from userdb.models.user import User
 from userdb import redis as redis_store
 
@@ -30,16 +37,53 @@ def auto_moto():
 
 
 @pytest.fixture(name="app", scope="session")
-def _app(session):
+def _app(session, db_path):
     """
     FastAPI TestClient app fixture.
-    Overrides `get_session` to use sqlite db and sets the default CurrentUser.
+    Overrides the db session dependencies to use sqlite db and sets the default
+    CurrentUser.
     """
 
+    # TestClient runs each request on its own event loop, so don't pool connections
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool
+    )
+
+    async def _get_async_session():
+        async with AsyncSession(async_engine, expire_on_commit=False) as async_session:
+            yield async_session
+
     fastapi_app.dependency_overrides[get_session] = lambda: session
+    fastapi_app.dependency_overrides[get_async_session] = _get_async_session
+    fastapi_app.dependency_overrides[get_read_session] = _get_async_session
     yield TestClient(fastapi_app)
 
 
+@pytest.fixture(name="lagging_replica")
+def _lagging_replica(tmp_path):
+    """
+    Routes reads to a replica that hasn't caught up with any writes.
+    """
+
+    replica_path = tmp_path / "replica.db"
+    schema_engine = create_engine(f"sqlite:///{replica_path}")
+    SQLModel.metadata.create_all(schema_engine)
+    schema_engine.dispose()
+
+    replica_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{replica_path}", poolclass=NullPool
+    )
+
+    async def _get_replica_session():
+        async with AsyncSession(replica_engine, expire_on_commit=False) as session:
+            yield session
+
+    primary = fastapi_app.dependency_overrides[get_read_session]
+    fastapi_app.dependency_overrides[get_read_session] = _get_replica_session
+    yield
+    fastapi_app.dependency_overrides[get_read_session] = primary
+
+
 @pytest.fixture(autouse=True)
 def _clear_client_state(app: TestClient):
     """
@@ -70,14 +114,22 @@ def _set_default_auth_header(app: TestClient, access_token) -> None:
     app.headers["Authorization"] = f"Bearer {access_token}"
 
 
+@pytest.fixture(name="db_path", scope="session")
+def _db_path(tmp_path_factory):
+    """
+    sqlite db file shared by the sync test session and the app's async sessions
+    (an in-memory db can't be shared between the two engines)
+    """
+    return tmp_path_factory.mktemp("db") / "test.db"
+
+
 @pytest.fixture(name="session", scope="session")
-def _session():
+def _session(db_path):
     """return sqlite test db session"""
 
     engine = create_engine(
-        "sqlite://",
+        f"sqlite:///{db_path}",
         connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
     )
     SQLModel.metadata.create_all(engine)
 
@@ -148,6 +200,7 @@ def patch_asyncio_sleep():
 def pre_cleanup(session: Session):
     """delete any users in the db before each test"""
     session.exec(delete(User))
+    session.exec(delete(UserBirthYearCount))
     session.commit()
 
 
@@ -185,11 +238,34 @@ def _access_token(username):
     return auth.create_access_token(subject=username)
 
 
-class FakeRedis:
+def _command(func):
+    """count calls to a FakeRedis command made outside other commands/pipelines"""
+
+    @functools.wraps(func)
+    async def wrapper(self: "FakeRedis", *args, **kwargs):
+        # pylint: disable=protected-access
+        if not self._depth:
+            self.round_trips += 1
+        self._depth += 1
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            self._depth -= 1
+
+    return wrapper
+
+
+class FakeRedis:  # pylint: disable=too-many-public-methods
     """Minimal in-memory Redis double for tests."""
 
     def __init__(self):
-        self._store: dict[str, tuple[str | set[str], float | None]] = {}
+        self._store: dict[
+            str, tuple[str | set[str] | dict[str, float], float | None]
+        ] = {}
+        # requests a real client would have sent to the server
+        self.round_trips = 0
+        self._depth = 0
+        self._subscribers: dict[str, list[FakePubSub]] = {}
 
     async def _is_expired(self, key: str) -> bool:
         item = self._store.get(key)
@@ -201,20 +277,62 @@ class FakeRedis:
             return True
         return False
 
-    async def set(self, key: str, value: str, ex: int | None = None):
-        expires_at = (time.time() + ex) if ex is not None else None
-        self._store[key] = (value, expires_at)
+    @_command
+    async def ping(self):
         return True
 
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self, transaction)
+
+    def register_script(self, script: str):
+        return FakeScript(self, script)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    def subscribers(self, channel: str):
+        return list(self._subscribers.get(channel, []))
+
+    @_command
+    async def publish(self, channel: str, message: str):
+        subscribers = self._subscribers.get(channel, [])
+        for pubsub in subscribers:
+            pubsub.messages.put_nowait(
+                {"type": "message", "channel": channel, "data": message}
+            )
+        return len(subscribers)
+
+    @_command
+    async def set(
+        self,
+        key: str,
+        value: str,
+        *,
+        ex: int | None = None,
+        nx: bool = False,
+        get: bool = False,
+    ):
+        # pylint: disable=too-many-arguments
+        old = None if await self._is_expired(key) else self._store[key][0]
+        if not (nx and old is not None):
+            expires_at = (time.time() + ex) if ex is not None else None
+            self._store[key] = (value, expires_at)
+        if get:
+            return old
+        return True if not (nx and old is not None) else None
+
+    @_command
     async def get(self, key: str):
         if await self._is_expired(key):
             return None
         value, _expires_at = self._store[key]
         return value
 
+    @_command
     async def delete(self, key: str):
         return 1 if self._store.pop(key, None) is not None else 0
 
+    @_command
     async def expire(self, key: str, ex: int):
         if await self._is_expired(key):
             return False
@@ -222,6 +340,15 @@ class FakeRedis:
         self._store[key] = (value, time.time() + ex)
         return True
 
+    @_command
+    async def incr(self, key: str):
+        current = await self.get(key)
+        _value, expires_at = self._store.get(key, (None, None))
+        value = int(current or 0) + 1
+        self._store[key] = (str(value), expires_at)
+        return value
+
+    @_command
     async def sadd(self, key: str, member: str):
         if await self._is_expired(key):
             current: set[str] = set()
@@ -235,6 +362,7 @@ class FakeRedis:
         self._store[key] = (current, expires_at)
         return added
 
+    @_command
     async def srem(self, key: str, member: str):
         if await self._is_expired(key):
             return 0
@@ -246,6 +374,7 @@ class FakeRedis:
         self._store[key] = (value, expires_at)
         return removed
 
+    @_command
     async def smembers(self, key: str):
         if await self._is_expired(key):
             return set()
@@ -254,6 +383,102 @@ class FakeRedis:
             return set(value)
         return set()
 
+    @_command
+    async def type(self, key: str):
+        if await self._is_expired(key):
+            return "none"
+        value, _expires_at = self._store[key]
+        if isinstance(value, set):
+            return "set"
+        return "zset" if isinstance(value, dict) else "string"
+
+    @_command
+    async def ttl(self, key: str):
+        if await self._is_expired(key):
+            return -2
+        _value, expires_at = self._store[key]
+        return -1 if expires_at is None else int(expires_at - time.time())
+
+    @_command
+    async def expireat(self, key: str, when: int):
+        if await self._is_expired(key):
+            return False
+        value, _ = self._store[key]
+        self._store[key] = (value, when)
+        return True
+
+    def _zset(self, key: str) -> dict[str, float]:
+        # only called after _is_expired, which drops expired keys
+        value, _expires_at = self._store.get(key, ({}, None))
+        if isinstance(value, set):
+            raise ResponseError(
+                "WRONGTYPE Operation against a key holding the wrong kind of value"
+            )
+        return value if isinstance(value, dict) else {}
+
+    @staticmethod
+    def _in_range(score: float, min_score: str | float, max_score: str | float):
+        def bound(value, below: bool):
+            value = str(value)
+            exclusive = value.startswith("(")
+            limit = float(value.lstrip("("))
+            if below:
+                return score > limit if exclusive else score >= limit
+            return score < limit if exclusive else score <= limit
+
+        return bound(min_score, True) and bound(max_score, False)
+
+    @_command
+    async def zadd(self, key: str, mapping: dict[str, float]):
+        if await self._is_expired(key):
+            self._store[key] = ({}, None)
+        zset = self._zset(key)
+        added = len(mapping.keys() - zset.keys())
+        zset.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    @_command
+    async def zrem(self, key: str, *members: str):
+        if await self._is_expired(key):
+            return 0
+        zset = self._zset(key)
+        return sum(zset.pop(member, None) is not None for member in members)
+
+    @_command
+    async def zrange(self, key: str, start: int, end: int):
+        if await self._is_expired(key):
+            return []
+        zset = self._zset(key)
+        members = sorted(zset, key=lambda member: (zset[member], member))
+        return members[start : None if end == -1 else end + 1]
+
+    @_command
+    async def zrangebyscore(
+        self, key: str, min_score, max_score, withscores: bool = False
+    ):
+        if await self._is_expired(key):
+            return []
+        zset = self._zset(key)
+        members = [
+            member
+            for member in await self.zrange(key, 0, -1)
+            if self._in_range(zset[member], min_score, max_score)
+        ]
+        if withscores:
+            return [(member, zset[member]) for member in members]
+        return members
+
+    @_command
+    async def zremrangebyscore(self, key: str, min_score, max_score):
+        members = await self.zrangebyscore(key, min_score, max_score)
+        return await self.zrem(key, *members) if members else 0
+
+    @_command
+    async def zremrangebyrank(self, key: str, start: int, end: int):
+        members = await self.zrange(key, start, end)
+        return await self.zrem(key, *members) if members else 0
+
+    @_command
     async def eval(self, _script: str, _numkeys: int, key: str):
         # Implements the get+del Lua behavior used by the app.
         val = await self.get(key)
@@ -262,10 +487,193 @@ class FakeRedis:
         return val
 
 
+class FakePubSub:
+    """Receives messages published on FakeRedis to subscribed channels."""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.channels: list[str] = []
+        self.messages: asyncio.Queue[dict | Exception] = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            # pylint: disable=protected-access
+            self.redis._subscribers.setdefault(channel, []).append(self)
+            self.channels.append(channel)
+
+    async def get_message(
+        self, ignore_subscribe_messages: bool = False, timeout: float | None = 0.0
+    ):
+        # subscribe confirmations aren't queued, so ignore_subscribe_messages is moot
+        del ignore_subscribe_messages
+        try:
+            message = await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        # put an exception on the queue to simulate a dropped connection
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def aclose(self):
+        for channel in self.channels:
+            # pylint: disable=protected-access
+            self.redis._subscribers[channel].remove(self)
+        self.channels = []
+
+
+class FakePipeline:
+    """Queues commands and runs them against FakeRedis on execute."""
+
+    def __init__(self, redis: FakeRedis, transaction: bool):
+        self.redis = redis
+        self.transaction = transaction
+        self._commands: list[tuple[str, tuple, dict]] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc):
+        self._commands.clear()
+
+    def __getattr__(self, name: str):
+        if not callable(getattr(self.redis, name, None)):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self):
+        commands, self._commands = self._commands, []
+        self.redis.round_trips += 1
+        self.redis._depth += 1  # pylint: disable=protected-access
+        try:
+            return [
+                await getattr(self.redis, name)(*args, **kwargs)
+                for name, args, kwargs in commands
+            ]
+        finally:
+            self.redis._depth -= 1  # pylint: disable=protected-access
+
+
+async def _trimmed_index(r: FakeRedis, key: str, now: float):
+    if await r.type(key) == "set":
+        expires_at = now + max(await r.ttl(key), 0)
+        tokens = await r.smembers(key)
+        await r.delete(key)
+        for token in tokens:
+            await r.zadd(key, {token: expires_at})
+    await r.zremrangebyscore(key, "-inf", now)
+
+
+async def _store_user_refresh_token(r: FakeRedis, keys: list[str], args: list[str]):
+    # pylint: disable=too-many-locals
+    token_key, index_key, generation_key = keys
+    info, ttl, token, now, max_sessions, token_key_prefix, generation_ttl = args
+    expires_at = float(now) + int(ttl)
+
+    await _trimmed_index(r, index_key, float(now))
+    await r.set(token_key, info, ex=int(ttl))
+    await r.zadd(index_key, {token: expires_at})
+
+    evicted = await r.zrange(index_key, 0, -int(max_sessions) - 1)
+    for evicted_token in evicted:
+        await r.delete(f"{token_key_prefix}{evicted_token}")
+    if evicted:
+        await r.zremrangebyrank(index_key, 0, len(evicted) - 1)
+
+    await r.expireat(index_key, math.ceil(expires_at))
+    await r.expire(generation_key, int(generation_ttl))
+    return int(await r.get(generation_key) or 0)
+
+
+async def _rotate_refresh_token(r: FakeRedis, keys: list[str], args: list[str]):
+    # pylint: disable=too-many-locals
+    old_key, new_key, index_key, generation_key = keys
+    username, new_info, ttl, old_token, new_token, now, generation_ttl = args
+
+    raw = await r.get(old_key)
+    try:
+        info = json.loads(raw) if raw else None
+    except json.JSONDecodeError:
+        info = None
+    if (
+        not isinstance(info, dict)
+        or info.get("user") != username
+        or info.get("revoked")
+    ):
+        return None
+
+    expires_at = float(now) + int(ttl)
+    await r.delete(old_key)
+    await r.set(new_key, new_info, ex=int(ttl))
+    await _trimmed_index(r, index_key, float(now))
+    await r.zrem(index_key, old_token)
+    await r.zadd(index_key, {new_token: expires_at})
+    await r.expireat(index_key, math.ceil(expires_at))
+    await r.expire(generation_key, int(generation_ttl))
+    return int(await r.get(generation_key) or 0)
+
+
+async def _revoke_user_refresh_tokens(r: FakeRedis, keys: list[str], args: list[str]):
+    (index_key,) = keys
+    (token_key_prefix,) = args
+
+    if await r.type(index_key) == "set":
+        tokens = await r.smembers(index_key)
+    else:
+        tokens = await r.zrange(index_key, 0, -1)
+    for token in tokens:
+        await r.delete(f"{token_key_prefix}{token}")
+    await r.delete(index_key)
+    return len(tokens)
+
+
+async def _bump_token_generation(r: FakeRedis, keys: list[str], args: list[str]):
+    (generation_key,) = keys
+    channel, username, ttl = args
+
+    generation = await r.incr(generation_key)
+    await r.expire(generation_key, int(ttl))
+    await r.publish(channel, f"{generation}:{username}")
+    return generation
+
+
+# python versions of the app's Lua scripts, keyed by script source
+FAKE_SCRIPTS = {
+    redis_store.STORE_USER_REFRESH_TOKEN_SCRIPT: _store_user_refresh_token,
+    redis_store.ROTATE_REFRESH_TOKEN_SCRIPT: _rotate_refresh_token,
+    redis_store.REVOKE_USER_REFRESH_TOKENS_SCRIPT: _revoke_user_refresh_tokens,
+    redis_store.BUMP_TOKEN_GENERATION_SCRIPT: _bump_token_generation,
+}
+
+
+class FakeScript:
+    """Runs the python version of a registered Lua script atomically."""
+
+    def __init__(self, redis: FakeRedis, script: str):
+        self.redis = redis
+        self.script = script
+
+    async def __call__(self, keys=(), args=(), client=None):
+        redis = client or self.redis
+        redis.round_trips += 1
+        redis._depth += 1  # pylint: disable=protected-access
+        try:
+            return await FAKE_SCRIPTS[self.script](
+                redis, list(keys), [str(arg) for arg in args]
+            )
+        finally:
+            redis._depth -= 1  # pylint: disable=protected-access
+
+
 @pytest.fixture(autouse=True)
 def fake_redis(monkeypatch):
     r = FakeRedis()
-    monkeypatch.setattr(redis_store, redis_store.get_redis.__name__, lambda: r)
+    monkeypatch.setattr(redis_store, "get_redis", lambda: r)
     yield r
 
 
@@ -57,9 +57,8 @@ def test_expired_token_returns_401(app):
 
 
 async def test_revoked_access_token_returns_401(app, fake_redis):
-    token = auth.create_access_token(subject="revoked-user")
-    revoked_key = redis_store.revoked_access_token_key(token)
-    await fake_redis.set(revoked_key, "1", ex=60)
+    token = auth.create_access_token(subject="revoked-user", generation=0)
+    await fake_redis.set(redis_store.token_generation_key("revoked-user"), "1")
 
     app.headers["Authorization"] = f"Bearer {token}"
     resp = app.get("/users")
@@ -4,7 +4,15 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
+import time
+from unittest import mock
+
+import pytest
+
 from userdb import redis as redis_store
+from userdb.utils import auth
 
 
 def test_login_sets_cookie_and_returns_access_token(app):
@@ -18,6 +26,18 @@ def test_login_sets_cookie_and_returns_access_token(app):
     assert "Path=/auth/refresh" in set_cookie
 
 
+async def test_login_stores_refresh_token_in_one_round_trip(app, fake_redis):
+    resp = app.post("/auth/login", json={"username": "Dave", "password": "pw"})
+
+    assert resp.status_code == 200
+    assert fake_redis.round_trips == 1
+
+    refresh_token = resp.cookies.get("refresh_token")
+    stored = await fake_redis.get(redis_store.refresh_token_key("dave", refresh_token))
+    assert '"user": "dave"' in stored
+    assert await redis_store.get_user_refresh_tokens("dave") == {refresh_token}
+
+
 def test_refresh_rotates_token_and_returns_access_token(app):
     login_resp = app.post("/auth/login", json={"username": "bob", "password": "pw"})
     assert login_resp.status_code == 200
@@ -32,6 +52,80 @@ def test_refresh_rotates_token_and_returns_access_token(app):
     assert "refresh_token=" in set_cookie
 
 
+async def test_refresh_rotates_in_one_round_trip(app, fake_redis):
+    login_resp = app.post("/auth/login", json={"username": "bob", "password": "pw"})
+    old_token = login_resp.cookies.get("refresh_token")
+    fake_redis.round_trips = 0
+
+    refresh_resp = app.post("/auth/refresh")
+
+    assert refresh_resp.status_code == 200
+    assert fake_redis.round_trips == 1
+
+    new_token = refresh_resp.cookies.get("refresh_token")
+    assert not await redis_store.get_refresh_token("bob", old_token)
+    assert (
+        json.loads(await redis_store.get_refresh_token("bob", new_token))["user"]
+        == "bob"
+    )
+    assert await redis_store.get_user_refresh_tokens("bob") == {new_token}
+
+
+async def test_rotate_refresh_token_concurrently(app):
+    login_resp = app.post("/auth/login", json={"username": "bob", "password": "pw"})
+    old_token = login_resp.cookies.get("refresh_token")
+
+    results = await asyncio.gather(
+        *(
+            redis_store.rotate_refresh_token(
+                "bob",
+                old_token,
+                f"{old_token}-{i}",
+                '{"user": "bob"}',
+                ex_seconds=60,
+                generation_ttl_seconds=60,
+            )
+            for i in range(2)
+        )
+    )
+
+    assert sorted(generation is not None for generation in results) == [False, True]
+    assert len(await redis_store.get_user_refresh_tokens("bob")) == 1
+
+
+@pytest.mark.parametrize(
+    "token_info",
+    [
+        None,
+        "not json",
+        json.dumps({"user": "mallory"}),
+        json.dumps({"user": "bob", "revoked": True}),
+    ],
+)
+async def test_refresh_rejects_invalid_token(app, fake_redis, token_info):
+    token = auth.create_refresh_token(user_id="bob")
+    if token_info:
+        await fake_redis.set(redis_store.refresh_token_key("bob", token), token_info)
+    app.cookies.set("refresh_token", token)
+
+    resp = app.post("/auth/refresh")
+
+    assert resp.status_code == 401
+    if token_info:
+        # nothing is changed
+        assert (
+            await fake_redis.get(redis_store.refresh_token_key("bob", token))
+            == token_info
+        )
+        assert not await redis_store.get_user_refresh_tokens("bob")
+
+
+def test_refresh_malformed_cookie_401(app):
+    app.cookies.set("refresh_token", "not-a-refresh-token")
+    resp = app.post("/auth/refresh")
+    assert resp.status_code == 401
+
+
 def test_refresh_missing_cookie_401(app):
     # Ensure no cookie is present
     app.cookies.clear()
@@ -141,7 +235,10 @@ def test_logout_bulk_revokes_all_refresh_tokens_for_user(app):
     assert resp2.status_code == 401
 
 
-async def test_logout_revokes_access_token_in_redis(app, fake_redis):
+async def test_logout_revokes_all_access_tokens(app, fake_redis):
+    other_session = app.post(
+        "/auth/login", json={"username": "frank", "password": "pw"}
+    )
     login_resp = app.post("/auth/login", json={"username": "frank", "password": "pw"})
     assert login_resp.status_code == 200
 
@@ -154,6 +251,147 @@ async def test_logout_revokes_access_token_in_redis(app, fake_redis):
     logout_resp = app.post("/auth/logout")
     assert logout_resp.status_code == 204
 
-    # Verify a revocation key was set in Redis.
-    revoked_key = redis_store.revoked_access_token_key(access_token)
-    assert await fake_redis.get(revoked_key) == "1"
+    # one INCR revokes every session, not just the presented token
+    assert await fake_redis.get(redis_store.token_generation_key("frank")) == "1"
+    app.headers["Authorization"] = f"Bearer {other_session.json()['access_token']}"
+    assert app.get("/users").status_code == 401
+
+    # logging in again mints tokens for the new generation
+    login_again = app.post("/auth/login", json={"username": "frank", "password": "pw"})
+    app.headers["Authorization"] = f"Bearer {login_again.json()['access_token']}"
+    assert app.get("/users").status_code == 200
+
+
+async def test_refresh_mints_current_generation(app, fake_redis):
+    app.post("/auth/login", json={"username": "ivy", "password": "pw"})
+    await fake_redis.set(redis_store.token_generation_key("ivy"), "3")
+
+    resp = app.post("/auth/refresh")
+
+    assert resp.status_code == 200
+    assert auth.verify_access_token(resp.json()["access_token"])["gen"] == 3
+
+
+async def test_token_generation_expires(app, fake_redis):
+    key = redis_store.token_generation_key("lou")
+    app.post("/auth/login", json={"username": "lou", "password": "pw"})
+    assert await fake_redis.get(key) is None
+
+    login = app.post("/auth/login", json={"username": "lou", "password": "pw"})
+    app.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+    app.post("/auth/logout")
+    assert 0 < await fake_redis.ttl(key) <= auth.TOKEN_GENERATION_TTL_SECONDS
+
+    # logging in or refreshing keeps it for as long as the new access token
+    await fake_redis.expire(key, 5)
+    app.post("/auth/login", json={"username": "lou", "password": "pw"})
+    assert await fake_redis.ttl(key) > auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+    await fake_redis.expire(key, 5)
+    assert app.post("/auth/refresh").status_code == 200
+    assert await fake_redis.ttl(key) > auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+async def test_logout_with_refresh_cookie_revokes_all_sessions(app, fake_redis):
+    tokens = []
+    for _ in range(3):
+        login = app.post("/auth/login", json={"username": "gina", "password": "pw"})
+        tokens.append(login.cookies.get("refresh_token"))
+
+    # only the refresh cookie identifies the user
+    app.headers.pop("Authorization")
+    app.cookies.clear()
+    app.cookies.set("refresh_token", tokens[0])
+    fake_redis.round_trips = 0
+
+    logout_resp = app.post("/auth/logout")
+
+    assert logout_resp.status_code == 204
+    # GET the cookie token, DEL it, revoke the rest in one call, then record the
+    # bump for loading workers and bump the token generation
+    assert fake_redis.round_trips == 5
+    for token in tokens:
+        assert not await redis_store.get_refresh_token("gina", token)
+    assert not await redis_store.get_user_refresh_tokens("gina")
+
+
+async def test_revoke_user_refresh_tokens(fake_redis):
+    for i in range(5):
+        await redis_store.store_user_refresh_token(
+            "hal",
+            f"token{i}",
+            "{}",
+            ex_seconds=60,
+            max_sessions=10,
+            generation_ttl_seconds=60,
+        )
+    fake_redis.round_trips = 0
+
+    assert await redis_store.revoke_user_refresh_tokens("hal") == 5
+
+    assert fake_redis.round_trips == 1
+    assert not await redis_store.get_user_refresh_tokens("hal")
+    assert not await redis_store.get_refresh_token("hal", "token0")
+    assert await redis_store.revoke_user_refresh_tokens("hal") == 0
+
+
+async def test_store_refresh_token_evicts_oldest_sessions(fake_redis):
+    now = time.time()
+    for i in range(4):
+        with mock.patch.object(redis_store.time, "time", return_value=now + i):
+            await redis_store.store_user_refresh_token(
+                "ian",
+                f"token{i}",
+                "{}",
+                ex_seconds=60,
+                max_sessions=3,
+                generation_ttl_seconds=60,
+            )
+
+    assert await redis_store.get_user_refresh_tokens("ian") == {
+        "token1",
+        "token2",
+        "token3",
+    }
+    assert not await redis_store.get_refresh_token("ian", "token0")
+    assert await fake_redis.zrange(redis_store.user_refresh_tokens_key("ian"), 0, -1)
+
+
+async def test_store_refresh_token_trims_expired_sessions(fake_redis):
+    index_key = redis_store.user_refresh_tokens_key("jo")
+    now = time.time()
+    for i in range(3):
+        with mock.patch.object(redis_store.time, "time", return_value=now + 1000 * i):
+            await redis_store.store_user_refresh_token(
+                "jo",
+                f"token{i}",
+                "{}",
+                ex_seconds=1500,
+                max_sessions=10,
+                generation_ttl_seconds=60,
+            )
+
+    # token0 expired 1500s after now, before token2 was stored 2000s after
+    assert await fake_redis.zrange(index_key, 0, -1) == ["token1", "token2"]
+
+
+async def test_get_user_refresh_tokens_legacy_set_index(fake_redis):
+    await fake_redis.sadd(redis_store.user_refresh_tokens_key("kim"), "old")
+
+    assert await redis_store.get_user_refresh_tokens("kim") == {"old"}
+
+
+async def test_legacy_set_index_is_converted(fake_redis):
+    index_key = redis_store.user_refresh_tokens_key("kim")
+    await fake_redis.sadd(index_key, "old")
+    await fake_redis.expire(index_key, 60)
+    await fake_redis.set(redis_store.refresh_token_key("kim", "old"), "{}", ex=60)
+
+    await redis_store.store_user_refresh_token(
+        "kim", "new", "{}", ex_seconds=60, max_sessions=10, generation_ttl_seconds=60
+    )
+
+    assert await fake_redis.type(index_key) == "zset"
+    assert await redis_store.get_user_refresh_tokens("kim") == {"old", "new"}
+    assert await redis_store.revoke_user_refresh_tokens("kim") == 2
+    assert not await redis_store.get_refresh_token("kim", "old")
@@ -0,0 +1,62 @@
+"""tests for routers/metrics.py"""
+
+from fastapi.testclient import TestClient
+import pytest
+
+from userdb.utils.auth import CurrentUser
+
+
+def test_db_pool_stats(app: TestClient):
+    """test pool stats are returned for the app engine"""
+
+    response = app.get("/metrics/db-pool")
+
+    assert response.status_code == 200
+    assert set(response.json()) == {
+        "size",
+        "checkedIn",
+        "checkedOut",
+        "overflow",
+        "checkouts",
+        "timeouts",
+        "totalWaitSeconds",
+        "maxWaitSeconds",
+    }
+
+
+def test_redis_stats(app: TestClient):
+    """test redis pool and command stats are returned"""
+
+    response = app.get("/metrics/redis")
+
+    assert response.status_code == 200
+    assert set(response.json()) == {
+        "maxConnections",
+        "inUse",
+        "available",
+        "checkouts",
+        "timeouts",
+        "totalWaitSeconds",
+        "maxWaitSeconds",
+        "commands",
+    }
+
+
+@pytest.mark.parametrize(
+    "roles, status_code",
+    [
+        (["user"], 403),
+        (["admin"], 200),
+    ],
+)
+def test_metrics_require_admin(
+    app: TestClient, set_current_user, roles: list[str], status_code: int
+):
+    """test metrics are only available to admins"""
+
+    set_current_user(CurrentUser(username="bob", roles=roles))
+
+    for path in ["/metrics/db-pool", "/metrics/redis"]:
+        response = app.get(path)
+
+        assert response.status_code == status_code
@@ -1,15 +1,26 @@
 """tests for routers/users.py module"""
 
-from datetime import date, timedelta
+# pylint: disable=too-many-lines
+
+from contextlib import contextmanager
+import csv
+from datetime import date, datetime, timedelta
+import io
 import json
+import os
+from unittest import mock
 import uuid
 from fastapi.testclient import TestClient
 from fastapi import status
 import pytest
-from sqlmodel import Session, select
+from redis.exceptions import RedisError
+from sqlalchemy import Connection, Engine, event
+from sqlmodel import Session, SQLModel, create_engine, insert, select, text
 
 from tests.conftest import create_user
-from userdb.models.user import User
+from userdb import redis as redis_store
+from userdb.models.user import User, UserSort
+from userdb.routers import users as users_router
 from userdb.utils.auth import CurrentUser
 
 public_user_keys = {
@@ -20,7 +31,7 @@ public_user_keys = {
 }
 
 
-class TestUsersRouter:
+class TestUsersRouter:  # pylint: disable=too-many-public-methods
     """test user handlers"""
 
     def new_user_data(self, **kwargs):
@@ -93,7 +104,7 @@ class TestUsersRouter:
         assert new_user["firstname"] == "Test"
         assert new_user["lastname"] == "uSEr"
         assert new_user["dateOfBirth"] == "2001-02-03"
-        assert uuid.UUID(new_user["id"]).version == 4
+        assert uuid.UUID(new_user["id"]).version == 7
 
         assert set(new_user) == public_user_keys
 
@@ -165,6 +176,8 @@ class TestUsersRouter:
 
         assert delete_response.status_code == status.HTTP_204_NO_CONTENT
 
+        # the delete was made by the app's own session
+        session.expire_all()
         assert len(session.exec(select(User)).all()) == 1
         assert session.exec(select(User)).one().deleted is True
 
@@ -200,3 +213,825 @@ class TestUsersRouter:
         response = app.delete(f"/user/{uuid.uuid4()}")
 
         assert response.status_code == status_code
+
+    def _create_users(self, session: Session, num_users: int) -> list[User]:
+        """create users with distinct, ascending created_at values"""
+        return [
+            create_user(
+                User(
+                    firstname=f"user{i}",
+                    lastname="ln",
+                    date_of_birth=date(2000, 1, 1),
+                    created_at=datetime(2024, 1, 1) + timedelta(minutes=i),
+                ),
+                session,
+            )
+            for i in range(num_users)
+        ]
+
+    @pytest.mark.parametrize(
+        "sort, expected",
+        [
+            ("created_at", ["user0", "user1", "user2", "user3", "user4"]),
+            ("-created_at", ["user4", "user3", "user2", "user1", "user0"]),
+        ],
+    )
+    def test_get_all_users_paginates(
+        self, app: TestClient, session: Session, sort: str, expected: list[str]
+    ):
+        """test following next cursors walks every user exactly once"""
+
+        self._create_users(session, 5)
+
+        pages = []
+        params = {"limit": 2, "sort": sort}
+        while True:
+            response = app.get("/users", params=params)
+            assert response.status_code == 200
+            pages.append([u["firstname"] for u in response.json()])
+
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params["cursor"] = next_cursor
+
+        assert pages == [expected[0:2], expected[2:4], expected[4:]]
+
+    def test_get_all_users_exact_page_has_no_cursor(
+        self, app: TestClient, session: Session
+    ):
+        """test no next cursor is returned when the last page is full"""
+
+        self._create_users(session, 2)
+
+        response = app.get("/users", params={"limit": 2})
+
+        assert len(response.json()) == 2
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_get_all_users_skips_deleted_rows_across_pages(
+        self, app: TestClient, session: Session
+    ):
+        """test deleted users don't appear on any page"""
+
+        users = self._create_users(session, 4)
+        users[2].deleted = True
+        session.add(users[2])
+        session.commit()
+
+        first = app.get("/users", params={"limit": 2})
+        second = app.get(
+            "/users",
+            params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]},
+        )
+
+        assert [u["firstname"] for u in first.json()] == ["user0", "user1"]
+        assert [u["firstname"] for u in second.json()] == ["user3"]
+
+    @pytest.mark.parametrize(
+        "cursor",
+        [
+            "not-a-cursor",
+            "W10",  # []
+            "WyJ4IiwieSJd",  # ["x","y"]
+        ],
+    )
+    def test_get_all_users_invalid_cursor(self, app: TestClient, cursor: str):
+        """test malformed cursors are rejected"""
+
+        response = app.get("/users", params={"cursor": cursor})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"] == "Invalid cursor"
+
+    @pytest.mark.parametrize("limit", [0, 1001])
+    def test_get_all_users_limit_bounds(self, app: TestClient, limit: int):
+        """test out of range page sizes are rejected"""
+
+        response = app.get("/users", params={"limit": limit})
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+    def test_bulk_create_users(self, app: TestClient, session: Session):
+        """test valid rows are created in order"""
+
+        names = ["Ann", "Bob", "Cat"]
+        rows = [self.new_user_data(firstname=name) for name in names]
+
+        response = app.post("/users/bulk", json={"users": rows})
+
+        assert response.status_code == 200
+        result = response.json()
+        assert result["errors"] == []
+        assert [u["firstname"] for u in result["created"]] == names
+        for user in result["created"]:
+            assert set(user) == public_user_keys
+
+        assert len(session.exec(select(User)).all()) == 3
+
+    def test_bulk_create_users_reports_row_errors(
+        self, app: TestClient, session: Session
+    ):
+        """test invalid rows are reported without aborting the batch"""
+
+        rows = [
+            self.new_user_data(firstname="Good"),
+            self.new_user_data(firstname="B4d"),
+            self.new_user_data(dateOfBirth="1850-01-01"),
+            {"firstname": "Missing"},
+            self.new_user_data(firstname="Also good"),
+        ]
+
+        response = app.post("/users/bulk", json={"users": rows})
+
+        assert response.status_code == 200
+        result = response.json()
+        assert [u["firstname"] for u in result["created"]] == ["Good", "Also good"]
+        assert [e["index"] for e in result["errors"]] == [1, 2, 3]
+        assert "must only contain" in result["errors"][0]["detail"]
+        assert "01/01/1900" in result["errors"][1]["detail"]
+        assert {e["type"] for e in result["errors"][2]["detail"]} == {"missing"}
+
+        assert len(session.exec(select(User)).all()) == 2
+
+    def test_bulk_create_users_reports_non_object_rows(
+        self, app: TestClient, session: Session
+    ):
+        """test rows that aren't objects are reported like any other invalid row"""
+
+        rows = ["Bad", self.new_user_data(firstname="Good"), None, [1, 2]]
+
+        response = app.post("/users/bulk", json={"users": rows})
+
+        assert response.status_code == 200
+        result = response.json()
+        assert [u["firstname"] for u in result["created"]] == ["Good"]
+        assert [e["index"] for e in result["errors"]] == [0, 2, 3]
+        for error in result["errors"]:
+            assert {e["type"] for e in error["detail"]} == {"model_attributes_type"}
+
+        assert len(session.exec(select(User)).all()) == 1
+
+    def test_bulk_create_users_all_invalid(self, app: TestClient, session: Session):
+        """test nothing is inserted when every row is invalid"""
+
+        response = app.post(
+            "/users/bulk", json={"users": [self.new_user_data(firstname="")]}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["created"] == []
+        assert len(response.json()["errors"]) == 1
+        assert len(session.exec(select(User)).all()) == 0
+
+    def test_bulk_create_users_too_many_rows(self, app: TestClient):
+        """test oversized batches are rejected outright"""
+
+        rows = [self.new_user_data()] * 5001
+
+        response = app.post("/users/bulk", json={"users": rows})
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+    @pytest.mark.parametrize(
+        "roles, status_code",
+        [
+            (["user"], 403),
+            (["admin"], 200),
+        ],
+    )
+    def test_bulk_create_users_requires_admin(
+        self, app: TestClient, set_current_user, roles, status_code
+    ):
+        """test bulk create requires admin role"""
+
+        set_current_user(CurrentUser(username="bob", roles=roles))
+
+        response = app.post("/users/bulk", json={"users": [self.new_user_data()]})
+
+        assert response.status_code == status_code
+
+    def test_export_users_ndjson(self, app: TestClient, session: Session):
+        """test users are exported one JSON object per line"""
+
+        users = self._create_users(session, 3)
+        users[1].deleted = True
+        session.add(users[1])
+        session.commit()
+
+        with mock.patch.object(users_router, "EXPORT_BATCH_SIZE", 1):
+            response = app.get("/users/export")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert 'filename="users.ndjson"' in response.headers["content-disposition"]
+
+        lines = response.text.splitlines()
+        exported = [json.loads(line) for line in lines]
+        assert [u["firstname"] for u in exported] == ["user0", "user2"]
+        for user in exported:
+            assert set(user) == public_user_keys
+
+    def test_export_users_csv(self, app: TestClient, session: Session):
+        """test users are exported as CSV with a header row"""
+
+        users = self._create_users(session, 2)
+
+        response = app.get("/users/export", params={"format": "csv"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert rows == [
+            ["firstname", "lastname", "dateOfBirth", "id"],
+            ["user0", "ln", "2000-01-01", str(users[0].id)],
+            ["user1", "ln", "2000-01-01", str(users[1].id)],
+        ]
+
+    def test_export_users_empty(self, app: TestClient):
+        """test exporting with no users only returns the CSV header"""
+
+        response = app.get("/users/export", params={"format": "csv"})
+
+        assert response.text.splitlines() == ["firstname,lastname,dateOfBirth,id"]
+
+    @pytest.mark.parametrize(
+        "roles, status_code",
+        [
+            (["user"], 403),
+            (["admin"], 200),
+        ],
+    )
+    def test_export_users_requires_admin(
+        self, app: TestClient, set_current_user, roles, status_code
+    ):
+        """test export requires admin role"""
+
+        set_current_user(CurrentUser(username="bob", roles=roles))
+
+        response = app.get("/users/export")
+
+        assert response.status_code == status_code
+
+    def test_get_all_users_served_from_cache(self, app: TestClient, session: Session):
+        """test repeat reads don't query the db until users change"""
+
+        self._create_users(session, 1)
+        first = app.get("/users")
+
+        # bypasses the API, so the cached list isn't invalidated
+        self._create_users(session, 2)
+        second = app.get("/users")
+
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        assert len(second.json()) == 1
+
+        app.post("/users/create", json={"user": self.new_user_data()})
+
+        assert len(app.get("/users").json()) == 4
+
+    def test_get_all_users_cache_keeps_next_cursor(
+        self, app: TestClient, session: Session
+    ):
+        """test cached pages return the same next cursor"""
+
+        self._create_users(session, 3)
+
+        first = app.get("/users", params={"limit": 2})
+        second = app.get("/users", params={"limit": 2})
+
+        assert second.json() == first.json()
+        assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+
+    def test_get_all_users_cache_keyed_on_params(
+        self, app: TestClient, session: Session
+    ):
+        """test different pages and orderings are cached separately"""
+
+        self._create_users(session, 3)
+
+        asc = app.get("/users", params={"limit": 2})
+        desc = app.get("/users", params={"limit": 2, "sort": "-created_at"})
+        everyone = app.get("/users")
+
+        assert [u["firstname"] for u in asc.json()] == ["user0", "user1"]
+        assert [u["firstname"] for u in desc.json()] == ["user2", "user1"]
+        assert len(everyone.json()) == 3
+
+    @pytest.mark.parametrize(
+        "write",
+        [
+            pytest.param(lambda app, user: app.delete(f"/user/{user.id}"), id="delete"),
+            pytest.param(
+                lambda app, _: app.post(
+                    "/users/bulk",
+                    json={
+                        "users": [
+                            {
+                                "firstname": "New",
+                                "lastname": "User",
+                                "dateOfBirth": "2001-02-03",
+                            }
+                        ]
+                    },
+                ),
+                id="bulk create",
+            ),
+        ],
+    )
+    def test_get_all_users_cache_invalidated_by_writes(
+        self, app: TestClient, session: Session, write
+    ):
+        """test writes through the API bump the users list version"""
+
+        (user,) = self._create_users(session, 1)
+        before = app.get("/users").json()
+
+        write(app, user)
+
+        assert app.get("/users").json() != before
+
+    @pytest.mark.usefixtures("lagging_replica")
+    def test_get_all_users_cache_miss_reads_primary(
+        self, app: TestClient, session: Session
+    ):
+        """test cached, ETagged pages aren't read from a lagging replica"""
+
+        self._create_users(session, 2)
+        app.post("/users/create", json={"user": self.new_user_data()})
+
+        first = app.get("/users")
+        assert len(first.json()) == 3
+
+        response = app.get("/users", headers={"If-None-Match": first.headers["ETag"]})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    @pytest.mark.usefixtures("lagging_replica")
+    def test_get_all_users_redis_unavailable_reads_replica(
+        self, app: TestClient, session: Session
+    ):
+        """test reads go to the replica when pages can't be cached"""
+
+        self._create_users(session, 2)
+
+        with mock.patch.object(
+            redis_store,
+            redis_store.get_users_list_version.__name__,
+            side_effect=RedisError("connection refused"),
+        ):
+            response = app.get("/users")
+
+        assert response.status_code == 200
+        assert response.json() == []
+        assert "ETag" not in response.headers
+
+    def test_get_all_users_redis_unavailable(self, app: TestClient, session: Session):
+        """test users are still listed from the db if the cache is down"""
+
+        self._create_users(session, 2)
+
+        with mock.patch.object(
+            redis_store,
+            redis_store.get_users_list_version.__name__,
+            side_effect=RedisError("connection refused"),
+        ):
+            response = app.get("/users")
+
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+
+    def test_get_all_users_etag_not_modified(self, app: TestClient, session: Session):
+        """test a matching If-None-Match gets a 304 without a body"""
+
+        self._create_users(session, 2)
+
+        first = app.get("/users")
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        response = app.get("/users", headers={"If-None-Match": etag})
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    @pytest.mark.parametrize(
+        "if_none_match",
+        [
+            pytest.param(lambda etag: f"W/{etag}", id="weak"),
+            pytest.param(lambda etag: f'"other", {etag}', id="list"),
+            pytest.param(lambda _: "*", id="any"),
+        ],
+    )
+    def test_get_all_users_etag_matching(
+        self, app: TestClient, session: Session, if_none_match
+    ):
+        """test If-None-Match forms that should match"""
+
+        self._create_users(session, 1)
+        etag = app.get("/users").headers["ETag"]
+
+        response = app.get("/users", headers={"If-None-Match": if_none_match(etag)})
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_get_all_users_etag_changes_after_write(
+        self, app: TestClient, session: Session
+    ):
+        """test a stale ETag gets the full, updated list"""
+
+        self._create_users(session, 1)
+        etag = app.get("/users").headers["ETag"]
+
+        app.post("/users/create", json={"user": self.new_user_data()})
+        response = app.get("/users", headers={"If-None-Match": etag})
+
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        assert response.headers["ETag"] != etag
+
+    async def test_get_all_users_etag_not_reused_after_version_lost(
+        self, app: TestClient, session: Session, fake_redis
+    ):
+        """test ETags from before the list version was lost don't match again"""
+
+        self._create_users(session, 1)
+        etag = app.get("/users").headers["ETag"]
+
+        await fake_redis.delete(redis_store.USERS_LIST_VERSION_KEY)
+        self._create_users(session, 1)
+
+        response = app.get("/users", headers={"If-None-Match": etag})
+
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+
+        # nor does a write start it again from 1
+        await fake_redis.delete(redis_store.USERS_LIST_VERSION_KEY)
+        app.post("/users/create", json={"user": self.new_user_data()})
+        assert int(await fake_redis.get(redis_store.USERS_LIST_VERSION_KEY)) > 1
+
+    def test_get_all_users_etag_differs_per_page(
+        self, app: TestClient, session: Session
+    ):
+        """test an ETag for one page doesn't match another"""
+
+        self._create_users(session, 3)
+        first = app.get("/users", params={"limit": 2})
+
+        response = app.get(
+            "/users",
+            params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]},
+            headers={"If-None-Match": first.headers["ETag"]},
+        )
+
+        assert response.status_code == 200
+        assert [u["firstname"] for u in response.json()] == ["user2"]
+
+    def test_create_user_single_statement(self, app: TestClient, session: Session):
+        """
+        test create is one INSERT ... RETURNING, without a follow up SELECT (plus
+        the stats count upsert)
+        """
+
+        statements = []
+
+        def _before_cursor_execute(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        with (
+            mock.patch.object(users_router.db, users_router.db.record_write.__name__),
+            _capture_sql(_before_cursor_execute),
+        ):
+            response = app.post("/users/create", json={"user": self.new_user_data()})
+
+        assert response.status_code == 200
+        insert_sql, stats_sql = [
+            s for s in statements if not s.startswith(("BEGIN", "COMMIT"))
+        ]
+        assert insert_sql.startswith("INSERT INTO user ")
+        assert stats_sql.startswith("INSERT INTO user_birth_year_count")
+        assert "RETURNING" in insert_sql
+
+        created = session.exec(select(User)).one()
+        assert str(created.id) == response.json()["id"]
+
+    def test_delete_user_already_deleted(self, app: TestClient, session: Session):
+        """test deleting an already deleted user doesn't invalidate the users cache"""
+
+        (user,) = self._create_users(session, 1)
+        user.deleted = True
+        session.add(user)
+        session.commit()
+
+        with mock.patch.object(
+            redis_store, redis_store.bump_users_list_version.__name__
+        ) as mock_bump:
+            response = app.delete(f"/user/{user.id}")
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        mock_bump.assert_not_called()
+
+    def test_bulk_delete_users(self, app: TestClient, session: Session):
+        """test several users are deleted together"""
+
+        users = self._create_users(session, 4)
+        users[3].deleted = True
+        session.add(users[3])
+        session.commit()
+
+        ids = [str(users[0].id), str(users[2].id), str(users[3].id), str(uuid.uuid4())]
+        response = app.post("/users/bulk-delete", json={"ids": ids})
+
+        assert response.status_code == 200
+        assert set(response.json()["deleted"]) == {ids[0], ids[1]}
+
+        session.expire_all()
+        assert {u.firstname for u in session.exec(select(User)) if u.deleted} == {
+            "user0",
+            "user2",
+            "user3",
+        }
+        assert [u["firstname"] for u in app.get("/users").json()] == ["user1"]
+
+    def test_bulk_delete_users_invalid_id(self, app: TestClient):
+        """test the whole request is rejected if an id is malformed"""
+
+        response = app.post("/users/bulk-delete", json={"ids": ["123"]})
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+    @pytest.mark.parametrize(
+        "roles, status_code",
+        [
+            (["user"], 403),
+            (["admin"], 200),
+        ],
+    )
+    def test_bulk_delete_users_requires_admin(
+        self, app: TestClient, set_current_user, roles, status_code
+    ):
+        """test bulk delete requires admin role"""
+
+        set_current_user(CurrentUser(username="bob", roles=roles))
+
+        response = app.post("/users/bulk-delete", json={"ids": [str(uuid.uuid4())]})
+
+        assert response.status_code == status_code
+
+    def _create_named_users(self, session: Session, *names: str) -> list[User]:
+        """create users with the given "firstname lastname" names"""
+        users = []
+        for name in names:
+            firstname, lastname = name.split(" ")
+            users.append(
+                create_user(
+                    User(
+                        firstname=firstname,
+                        lastname=lastname,
+                        date_of_birth=date(2000, 1, 1),
+                    ),
+                    session,
+                )
+            )
+        return users
+
+    @pytest.mark.parametrize(
+        "q, expected",
+        [
+            ("zoe", ["Zoë Adams", "Chloe Zoellner"]),
+            ("ZOË", ["Zoë Adams", "Chloe Zoellner"]),
+            ("odegard", ["Martin Ødegård"]),
+            ("e z", ["Chloe Zoellner"]),
+            ("nobody", []),
+        ],
+    )
+    def test_search_users(self, app: TestClient, session: Session, q, expected):
+        """test search ignores case and accents and lists prefix matches first"""
+
+        self._create_named_users(
+            session, "Chloe Zoellner", "Martin Ødegård", "Zoë Adams", "Ann Other"
+        )
+
+        response = app.get("/users/search", params={"q": q})
+
+        assert response.status_code == 200
+        assert [
+            f"{u['firstname']} {u['lastname']}" for u in response.json()
+        ] == expected
+        assert all(set(u) == public_user_keys for u in response.json())
+
+    def test_search_users_skips_deleted(self, app: TestClient, session: Session):
+        """test deleted users aren't found"""
+
+        users = self._create_named_users(session, "Ann Smith", "Ann Jones")
+        users[0].deleted = True
+        session.add(users[0])
+        session.commit()
+
+        response = app.get("/users/search", params={"q": "ann"})
+
+        assert [u["lastname"] for u in response.json()] == ["Jones"]
+
+    def test_search_users_wildcards_are_literal(
+        self, app: TestClient, session: Session
+    ):
+        """test LIKE wildcards in the query don't match everything"""
+
+        self._create_named_users(session, "Ann Smith")
+
+        assert app.get("/users/search", params={"q": "%"}).json() == []
+        assert app.get("/users/search", params={"q": "_"}).json() == []
+
+    def test_search_users_limit(self, app: TestClient, session: Session):
+        """test results are capped at `limit`"""
+
+        self._create_named_users(session, "Ann Smith", "Ann Jones", "Ann Brown")
+
+        response = app.get("/users/search", params={"q": "ann", "limit": 2})
+
+        assert [u["lastname"] for u in response.json()] == ["Brown", "Jones"]
+
+    @pytest.mark.parametrize(
+        "params", [{}, {"q": ""}, {"q": "a" * 101}, {"q": "a", "limit": 101}]
+    )
+    def test_search_users_invalid_params(self, app: TestClient, params):
+        """test bad search parameters are rejected"""
+
+        response = app.get("/users/search", params=params)
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+    def _user_stats(self, app: TestClient) -> tuple[int, dict[int, int]]:
+        """total and {band min age: count} from /users/stats"""
+        response = app.get("/users/stats")
+        assert response.status_code == 200
+        body = response.json()
+        return body["total"], {b["minAge"]: b["count"] for b in body["ageBands"]}
+
+    def test_user_stats_empty(self, app: TestClient):
+        """test stats with no users"""
+
+        response = app.get("/users/stats")
+
+        assert response.json() == {
+            "total": 0,
+            "ageBands": [
+                {"minAge": low, "maxAge": high, "count": 0}
+                for low, high in users_router.AGE_BANDS
+            ],
+        }
+
+    def test_user_stats_track_writes(self, app: TestClient):
+        """test creates and deletes update the counts"""
+
+        year = date.today().year
+
+        def dob(age: int) -> str:
+            return f"{year - age}-01-01"
+
+        created = app.post(
+            "/users/create", json={"user": self.new_user_data(dateOfBirth=dob(20))}
+        ).json()
+        app.post(
+            "/users/bulk",
+            json={
+                "users": [
+                    self.new_user_data(dateOfBirth=dob(20)),
+                    self.new_user_data(dateOfBirth=dob(40)),
+                    self.new_user_data(dateOfBirth=dob(70)),
+                    self.new_user_data(dateOfBirth="bad"),
+                ]
+            },
+        )
+
+        assert self._user_stats(app) == (
+            4,
+            {16: 2, 25: 0, 35: 1, 45: 0, 55: 0, 65: 1},
+        )
+
+        app.delete(f"/user/{created['id']}")
+        app.delete(f"/user/{created['id']}")
+
+        assert self._user_stats(app)[0] == 3
+
+        ids = [u["id"] for u in app.get("/users").json()]
+        app.post("/users/bulk-delete", json={"ids": ids + [str(uuid.uuid4())]})
+
+        assert self._user_stats(app) == (
+            0,
+            {16: 0, 25: 0, 35: 0, 45: 0, 55: 0, 65: 0},
+        )
+
+    def test_user_stats_not_require_admin(self, app: TestClient, set_current_user):
+        """test stats are available to all users"""
+
+        set_current_user(CurrentUser(username="bob", roles=["user"]))
+
+        assert app.get("/users/stats").status_code == 200
+
+
+@contextmanager
+def _capture_sql(listener):
+    """call `listener` before every statement the app runs on sqlite"""
+
+    event.listen(Engine, "before_cursor_execute", listener)
+    try:
+        yield
+    finally:
+        event.remove(Engine, "before_cursor_execute", listener)
+
+
+@contextmanager
+def explain(conn: Connection, prefix: str):
+    """collect the plan rows for each statement run on `conn` while active"""
+
+    plans: list[list[tuple]] = []
+
+    def _before_cursor_execute(
+        _conn, cursor, statement, parameters, _context, _executemany
+    ):
+        cursor.execute(f"{prefix} {statement}", parameters)
+        plans.append(cursor.fetchall())
+
+    event.listen(conn, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield plans
+    finally:
+        event.remove(conn, "before_cursor_execute", _before_cursor_execute)
+
+
+list_query_cases = [
+    pytest.param(UserSort.CREATED_AT, False, id="first page"),
+    pytest.param(UserSort.CREATED_AT, True, id="next page"),
+    pytest.param(UserSort.CREATED_AT_DESC, False, id="first page desc"),
+    pytest.param(UserSort.CREATED_AT_DESC, True, id="next page desc"),
+]
+
+
+class TestListUsersQueryPlan:
+    """check the users list query is served by the active users index"""
+
+    def list_query(self, sort: UserSort, with_cursor: bool):
+        """the statement GET /users runs for a page"""
+        after = (datetime(2024, 1, 1), uuid.uuid4()) if with_cursor else None
+        return users_router.list_users_query(sort=sort, after=after).limit(
+            users_router.DEFAULT_PAGE_SIZE + 1
+        )
+
+    @pytest.mark.parametrize("sort, with_cursor", list_query_cases)
+    def test_sqlite_plan_uses_active_index(
+        self, session: Session, sort: UserSort, with_cursor: bool
+    ):
+        """test sqlite walks the partial index without a scan or sort"""
+
+        conn = session.connection()
+        with explain(conn, "EXPLAIN QUERY PLAN") as plans:
+            conn.execute(self.list_query(sort, with_cursor))
+
+        plan = " | ".join(row[-1] for row in plans[0])
+
+        assert "USING INDEX ix_user_active_created_at_id" in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
+
+    @pytest.mark.skipif(
+        not os.getenv("TEST_POSTGRES_URL"),
+        reason="set TEST_POSTGRES_URL to a scratch postgres db to check its plans",
+    )
+    @pytest.mark.parametrize("sort, with_cursor", list_query_cases)
+    def test_postgres_plan_uses_active_index(self, sort: UserSort, with_cursor: bool):
+        """test postgres uses the partial index rather than a sequential scan"""
+
+        engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+        SQLModel.metadata.drop_all(engine)
+        SQLModel.metadata.create_all(engine)
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    insert(User),
+                    [
+                        {
+                            "id": uuid.uuid4(),
+                            "firstname": "fn",
+                            "lastname": "ln",
+                            "date_of_birth": date(2000, 1, 1),
+                            "created_at": datetime(2024, 1, 1) + timedelta(seconds=i),
+                            "deleted": i % 4 == 0,
+                        }
+                        for i in range(20_000)
+                    ],
+                )
+                conn.execute(text('ANALYZE "user"'))
+
+                with explain(conn, "EXPLAIN") as plans:
+                    conn.execute(self.list_query(sort, with_cursor))
+
+            plan = "\n".join(row[0] for row in plans[0])
+            assert "ix_user_active_created_at_id" in plan, plan
+            assert "Seq Scan" not in plan, plan
+        finally:
+            SQLModel.metadata.drop_all(engine)
+            engine.dispose()
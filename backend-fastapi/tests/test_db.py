@@ -0,0 +1,284 @@
+"""tests for db.py"""
+
+from datetime import date
+import os
+from unittest import mock
+
+import pytest
+from redis.exceptions import RedisError
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, create_engine, select
+
+from tests.conftest import create_user
+from userdb import db
+from userdb import redis as redis_store
+from userdb.models.stats import UserBirthYearCount
+from userdb.models.user import User
+
+
+def test_pool_options_defaults():
+    """test pool defaults when nothing is configured"""
+
+    with mock.patch.dict(os.environ, clear=True):
+        options = db.pool_options()
+
+    assert options == {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30.0,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
+
+
+def test_pool_options_from_env():
+    """test pool settings are read from env"""
+
+    env = {
+        "DB_POOL_SIZE": "20",
+        "DB_MAX_OVERFLOW": "0",
+        "DB_POOL_TIMEOUT": "2.5",
+        "DB_POOL_RECYCLE": "300",
+        "DB_POOL_PRE_PING": "false",
+    }
+    with mock.patch.dict(os.environ, env):
+        options = db.pool_options()
+
+    assert options == {
+        "pool_size": 20,
+        "max_overflow": 0,
+        "pool_timeout": 2.5,
+        "pool_recycle": 300,
+        "pool_pre_ping": False,
+    }
+
+
+def test_async_engine_uses_timed_pool():
+    """test the app engine records checkout waits"""
+    assert isinstance(db.async_engine.pool, db.TimedAsyncQueuePool)
+
+
+@pytest.fixture(name="timed_engine")
+async def _timed_engine(tmp_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=db.TimedAsyncQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    yield engine
+    await engine.dispose()
+
+
+async def test_pool_stats_counts_checkouts(timed_engine):
+    """test checkouts and the connection in use are reported"""
+
+    async with timed_engine.connect() as conn:
+        await conn.execute(text("select 1"))
+        stats = db.pool_stats(timed_engine)
+        assert stats.checked_out == 1
+
+    stats = db.pool_stats(timed_engine)
+    assert stats.size == 1
+    assert stats.checked_out == 0
+    assert stats.checked_in == 1
+    assert stats.overflow == 0
+    assert stats.checkouts == 1
+    assert stats.timeouts == 0
+    assert stats.max_wait_seconds >= 0
+    assert stats.total_wait_seconds >= stats.max_wait_seconds
+
+
+async def test_pool_stats_counts_timeouts(timed_engine):
+    """test waiting on an exhausted pool is recorded as a timeout"""
+
+    async with timed_engine.connect():
+        with pytest.raises(db.exc.TimeoutError):
+            async with timed_engine.connect():
+                pass
+
+    stats = db.pool_stats(timed_engine)
+    assert stats.checkouts == 2
+    assert stats.timeouts == 1
+    assert stats.max_wait_seconds >= 0.05
+
+
+def test_replica_hosts():
+    """test replica hosts are parsed from env"""
+
+    with mock.patch.dict(
+        os.environ, {"POSTGRES_REPLICA_HOSTS": " replica-a:5432, ,replica-b:5433 "}
+    ):
+        assert db.replica_hosts() == ["replica-a:5432", "replica-b:5433"]
+
+    with mock.patch.dict(os.environ, clear=True):
+        assert not db.replica_hosts()
+
+
+def _engine(checked_out: int = 0):
+    return mock.Mock(pool=mock.Mock(**{"checkedout.return_value": checked_out}))
+
+
+def test_replica_selector_round_robin():
+    """test replicas are used in turn"""
+
+    engines = [_engine(), _engine()]
+    selector = db.ReplicaSelector(engines, db.ReplicaSelection.ROUND_ROBIN)
+
+    assert [selector.choose() for _ in range(3)] == [engines[0], engines[1], engines[0]]
+
+
+def test_replica_selector_least_connections():
+    """test the replica with fewest connections in use is chosen"""
+
+    engines = [_engine(3), _engine(1), _engine(2)]
+    selector = db.ReplicaSelector(engines, db.ReplicaSelection.LEAST_CONNECTIONS)
+
+    assert selector.choose() is engines[1]
+
+
+@pytest.fixture(name="replicas")
+def _replicas():
+    engines = [_engine(), _engine()]
+    with mock.patch.object(
+        db, "replicas", db.ReplicaSelector(engines, db.ReplicaSelection.ROUND_ROBIN)
+    ):
+        yield engines
+
+
+async def test_read_engine_without_replicas():
+    """test reads use the primary when no replicas are configured"""
+
+    assert await db.read_engine("someone") is db.async_engine
+
+
+async def test_record_write_without_replicas(fake_redis):
+    """test writes aren't tracked when there are no replicas to lag"""
+
+    await db.record_write("someone")
+
+    assert await fake_redis.get(redis_store.recent_db_write_key("someone")) is None
+
+
+async def test_read_engine_uses_replicas(replicas):
+    """test reads are spread over the replicas"""
+
+    assert [await db.read_engine("someone") for _ in range(2)] == replicas
+
+
+async def test_read_engine_sticks_to_primary_after_write(replicas):
+    """test a user's reads go to the primary just after they write"""
+
+    await db.record_write("Writer")
+
+    assert await db.read_engine("writer") is db.async_engine
+    assert await db.read_engine("someone-else") is replicas[0]
+
+
+async def test_read_your_writes_window_expires(replicas, fake_redis):
+    """test the primary is only used for the configured window"""
+
+    await db.record_write("writer")
+    key = redis_store.recent_db_write_key("writer")
+    assert await fake_redis.get(key) == "1"
+
+    await fake_redis.delete(key)
+
+    assert await db.read_engine("writer") is replicas[0]
+
+
+@pytest.mark.usefixtures("replicas")
+async def test_read_engine_redis_error_uses_primary():
+    """test reads fall back to the primary if writes can't be checked"""
+
+    with mock.patch.object(
+        redis_store, "has_recent_db_write", side_effect=RedisError("down")
+    ):
+        assert await db.read_engine("someone") is db.async_engine
+
+
+def test_migrate_user_primary_key_noop(session):
+    """test tables that already have an id-only key are left alone"""
+
+    engine = session.get_bind()
+    db.migrate_user_primary_key(engine)
+
+    assert inspect(engine).get_pk_constraint("user")["constrained_columns"] == ["id"]
+
+
+@pytest.mark.skipif(
+    not os.getenv("TEST_POSTGRES_URL"),
+    reason="set TEST_POSTGRES_URL to a scratch postgres db to test migrations",
+)
+def test_migrate_user_primary_key_postgres():
+    """test the old (id, created_at) key is replaced and rows are kept"""
+
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    SQLModel.metadata.drop_all(engine)
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    'CREATE TABLE "user" ('
+                    "firstname VARCHAR(100) NOT NULL, "
+                    "lastname VARCHAR(100) NOT NULL, "
+                    "date_of_birth DATE NOT NULL, "
+                    "id UUID NOT NULL, "
+                    "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+                    "deleted BOOLEAN NOT NULL, "
+                    "PRIMARY KEY (id, created_at))"
+                )
+            )
+            conn.execute(
+                text(
+                    'INSERT INTO "user" VALUES '
+                    "('a', 'b', '2000-01-01', gen_random_uuid(), now(), false)"
+                )
+            )
+
+        db.migrate_user_primary_key(engine)
+
+        pk = inspect(engine).get_pk_constraint("user")
+        assert pk["constrained_columns"] == ["id"]
+        with engine.connect() as conn:
+            assert conn.execute(text('SELECT count(*) FROM "user"')).scalar() == 1
+    finally:
+        SQLModel.metadata.drop_all(engine)
+        engine.dispose()
+
+
+def test_backfill_user_stats(session):
+    """test empty stats counts are filled from active users"""
+
+    for year, deleted in [(1990, False), (1990, False), (1985, False), (1970, True)]:
+        create_user(
+            User(
+                firstname="a",
+                lastname="b",
+                date_of_birth=date(year, 6, 1),
+                deleted=deleted,
+            ),
+            session,
+        )
+
+    db.backfill_user_stats(session.connection())
+    counts = {r.birth_year: r.count for r in session.exec(select(UserBirthYearCount))}
+
+    assert counts == {1990: 2, 1985: 1}
+
+
+def test_backfill_user_stats_keeps_existing_counts(session):
+    """test counts aren't recomputed once they exist"""
+
+    create_user(
+        User(firstname="a", lastname="b", date_of_birth=date(1990, 6, 1)), session
+    )
+    session.add(UserBirthYearCount(birth_year=1990, count=5))
+    session.commit()
+
+    db.backfill_user_stats(session.connection())
+
+    assert session.exec(select(UserBirthYearCount.count)).all() == [5]
@@ -1,6 +1,15 @@
 """tests for main.py"""
 
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
 from fastapi.testclient import TestClient
+import pytest
+
+from userdb import main, serve
 
 
 def test_ok(app: TestClient):
@@ -8,3 +17,82 @@ def test_ok(app: TestClient):
     response = app.get("/")
     assert response.status_code == 200
     assert response.text == '"OK :)"'
+
+
+@pytest.mark.parametrize("skip, init_calls", [(None, 1), ("true", 0)])
+def test_lifespan_init_db(skip: str | None, init_calls: int):
+    """test startup initialises the db unless the server launcher already has"""
+
+    env = {serve.SKIP_INIT_DB_ENV: skip} if skip else {}
+    with (
+        mock.patch.dict(os.environ, env),
+        mock.patch.object(main.db, "init_db") as mock_init_db,
+        mock.patch.object(main.resources, "warm_up"),
+        mock.patch.object(main.resources, "release"),
+        TestClient(main.app),
+    ):
+        pass
+
+    assert mock_init_db.call_count == init_calls
+
+
+# generous enough for slow CI machines, but well short of what loading the AWS
+# SDK in every worker would cost
+IMPORT_SECONDS_BUDGET = 3.0
+IMPORT_RSS_MIB_BUDGET = 120
+
+# only needed by the document endpoints, so loaded on first use
+LAZY_MODULES = ["boto3", "botocore", "s3transfer", "dateutil"]
+
+_MEASURE_IMPORT = """
+import json, re, sys, time
+start = time.perf_counter()
+import userdb.main
+with open("/proc/self/status", encoding="ascii") as status:
+    peak_kib = re.search(r"VmHWM:\\s+(\\d+) kB", status.read()).group(1)
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "rss_mib": int(peak_kib) / 1024,
+    "modules": sorted({name.split(".")[0] for name in sys.modules}),
+}))
+"""
+
+
+# ru_maxrss survives exec on linux, so would include the forked pytest process
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="reads peak RSS from /proc"
+)
+def test_import_budget():
+    """test a fresh worker imports the app quickly and without the AWS SDK"""
+
+    result = subprocess.run(
+        [sys.executable, "-c", _MEASURE_IMPORT],
+        capture_output=True,
+        check=True,
+        env=os.environ | {"PYTHONPATH": os.pathsep.join(sys.path)},
+        text=True,
+    )
+    measured = json.loads(result.stdout.splitlines()[-1])
+
+    assert not set(LAZY_MODULES) & set(measured["modules"])
+    assert measured["seconds"] < IMPORT_SECONDS_BUDGET, measured["seconds"]
+    assert measured["rss_mib"] < IMPORT_RSS_MIB_BUDGET, measured["rss_mib"]
+
+
+def test_lifespan_warms_up_and_releases_resources():
+    """test shared resources are warmed up at startup and released at shutdown"""
+
+    calls = []
+    with (
+        mock.patch.object(main.db, "init_db"),
+        mock.patch.object(
+            main.resources, "warm_up", side_effect=lambda: calls.append("warm up")
+        ),
+        mock.patch.object(
+            main.resources, "release", side_effect=lambda: calls.append("release")
+        ),
+    ):
+        with TestClient(main.app):
+            assert calls == ["warm up"]
+
+    assert calls == ["warm up", "release"]
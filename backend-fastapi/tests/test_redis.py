@@ -0,0 +1,342 @@
+"""
+tests for redis.py. the Lua scripts, which the test double only emulates in python,
+run against a real server when TEST_REDIS_URL is set.
+"""
+
+import json
+import os
+from unittest import mock
+
+import pytest
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline, PubSub
+from redis.cluster import key_slot
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from userdb import redis as redis_store
+
+
+def test_pool_options_defaults():
+    """test the default pool settings"""
+
+    options = redis_store.pool_options()
+
+    assert options["max_connections"] == 50
+    assert options["timeout"] == 2
+    assert options["socket_timeout"] == 1
+    assert options["socket_connect_timeout"] == 1
+    assert options["health_check_interval"] == 30
+    assert options["retry"].get_retries() == 2
+
+
+def test_pool_options_from_env(monkeypatch):
+    """test pool settings are read from env"""
+
+    monkeypatch.setenv("REDIS_MAX_CONNECTIONS", "5")
+    monkeypatch.setenv("REDIS_POOL_TIMEOUT", "0.5")
+    monkeypatch.setenv("REDIS_SOCKET_TIMEOUT", "0.25")
+    monkeypatch.setenv("REDIS_CONNECT_TIMEOUT", "0.1")
+    monkeypatch.setenv("REDIS_HEALTH_CHECK_INTERVAL", "0")
+    monkeypatch.setenv("REDIS_RETRIES", "0")
+
+    options = redis_store.pool_options()
+
+    assert options["max_connections"] == 5
+    assert options["timeout"] == 0.5
+    assert options["socket_timeout"] == 0.25
+    assert options["socket_connect_timeout"] == 0.1
+    assert options["health_check_interval"] == 0
+    assert options["retry"].get_retries() == 0
+
+
+def test_user_keys_share_a_cluster_slot():
+    """test a user's token keys hash to one slot, and other users' don't"""
+
+    slots = {
+        key_slot(key.encode())
+        for key in [
+            redis_store.refresh_token_key("Bob", "refresh-bob-1"),
+            redis_store.refresh_token_key("bob", "refresh-bob-2"),
+            redis_store.user_refresh_tokens_key("bob"),
+        ]
+    }
+
+    assert len(slots) == 1
+    assert key_slot(redis_store.user_refresh_tokens_key("alice").encode()) not in slots
+
+
+def test_redis_mode(monkeypatch):
+    """test REDIS_MODE is validated"""
+
+    assert redis_store.redis_mode() == "standalone"
+
+    monkeypatch.setenv("REDIS_MODE", "Cluster")
+    assert redis_store.redis_mode() == "cluster"
+
+    monkeypatch.setenv("REDIS_MODE", "replicated")
+    with pytest.raises(ValueError):
+        redis_store.redis_mode()
+
+
+def test_sentinel_hosts(monkeypatch):
+    """test sentinel addresses are parsed, defaulting the port"""
+
+    monkeypatch.setenv("REDIS_SENTINELS", "sentinel-1:26380, sentinel-2")
+
+    assert redis_store.sentinel_hosts() == [
+        ("sentinel-1", 26380),
+        ("sentinel-2", 26379),
+    ]
+
+
+@pytest.fixture(name="real_client")
+async def _real_client(monkeypatch):
+    """the app's client, built for REDIS_MODE without connecting"""
+    monkeypatch.setenv("REDIS_SENTINELS", "sentinel-1:26379")
+    # undo the autouse fake
+    # pylint: disable-next=protected-access
+    monkeypatch.setattr(redis_store, "get_redis", redis_store._get_redis_client)
+    redis_store._get_redis_client.cache_clear()  # pylint: disable=protected-access
+    yield redis_store.get_redis
+    await redis_store.close_redis()
+
+
+@pytest.mark.parametrize(
+    "mode, client_type, pipeline_type",
+    [
+        ("standalone", redis_store.TimedRedis, redis_store.TimedPipeline),
+        ("sentinel", redis_store.TimedRedis, redis_store.TimedPipeline),
+        ("cluster", redis_store.TimedRedisCluster, redis_store.TimedClusterPipeline),
+    ],
+)
+def test_client_for_mode(
+    real_client, monkeypatch, mode: str, client_type: type, pipeline_type: type
+):
+    """test each REDIS_MODE builds a timed client, and pub/sub works in all of them"""
+
+    monkeypatch.setenv("REDIS_MODE", mode)
+
+    client = real_client()
+
+    assert type(client) is client_type  # pylint: disable=unidiomatic-typecheck
+    assert isinstance(client.pipeline(), pipeline_type)
+    assert isinstance(redis_store.pubsub(), PubSub)
+    assert redis_store.redis_stats().commands == {}
+
+
+@pytest.fixture(name="timed_client")
+async def _timed_client():
+    pool = redis_store.TimedBlockingConnectionPool(max_connections=1, timeout=0.01)
+    client = redis_store.TimedRedis.from_pool(pool)
+    yield client
+    await client.aclose()
+
+
+async def test_timed_redis_records_commands(timed_client: redis_store.TimedRedis):
+    """test command latency is recorded per command, including failures"""
+
+    with mock.patch.object(
+        aioredis.Redis,
+        "execute_command",
+        side_effect=["v", RedisConnectionError("down")],
+    ):
+        assert await timed_client.get("k") == "v"
+        with pytest.raises(RedisConnectionError):
+            await timed_client.get("k")
+
+    stats = timed_client.command_stats["GET"]
+    assert stats.count == 2
+    assert stats.errors == 1
+    assert stats.total_seconds >= stats.max_seconds > 0
+
+
+async def test_timed_redis_records_pipelines(timed_client: redis_store.TimedRedis):
+    """test a pipeline is recorded as one round trip"""
+
+    with mock.patch.object(Pipeline, "execute", return_value=[True, 1]):
+        await timed_client.pipeline().set("k", "v").sadd("s", "k").execute()
+        await timed_client.pipeline(transaction=False).get("k").execute()
+
+    assert timed_client.command_stats.keys() == {"MULTI", "PIPELINE"}
+    assert timed_client.command_stats["MULTI"].count == 1
+
+
+async def test_timed_pool_counts_timeouts(
+    timed_client: redis_store.TimedRedis, monkeypatch
+):
+    """test waiting on a saturated pool is counted as a timeout"""
+
+    pool = timed_client.connection_pool
+    pool._in_use_connections.add(mock.AsyncMock())  # pylint: disable=protected-access
+
+    with pytest.raises(RedisConnectionError):
+        await pool.get_connection()
+
+    monkeypatch.setattr(redis_store, "_get_redis_client", lambda: timed_client)
+    stats = redis_store.redis_stats()
+    assert stats.in_use == 1
+    assert stats.checkouts == 1
+    assert stats.timeouts == 1
+    assert stats.max_wait_seconds >= 0.01
+
+
+@pytest.fixture(name="real_redis")
+async def _real_redis(monkeypatch):
+    if not os.getenv("TEST_REDIS_URL"):
+        pytest.skip("set TEST_REDIS_URL to a scratch redis db to run its scripts")
+    client = aioredis.Redis.from_url(
+        os.environ["TEST_REDIS_URL"], decode_responses=True
+    )
+    await client.flushdb()
+    monkeypatch.setattr(redis_store, "get_redis", lambda: client)
+    yield client
+    await client.flushdb()
+    await client.aclose()
+
+
+async def test_script_registered_once(real_redis: aioredis.Redis):
+    """test a script is registered once per client and reused"""
+    # pylint: disable=protected-access
+
+    script = redis_store._script(redis_store.ROTATE_REFRESH_TOKEN_SCRIPT)
+
+    assert script.registered_client is real_redis
+    assert redis_store._script(redis_store.ROTATE_REFRESH_TOKEN_SCRIPT) is script
+
+
+async def test_rotate_refresh_token(real_redis: aioredis.Redis):
+    """test rotation swaps and re-indexes the token, once"""
+
+    await redis_store.store_user_refresh_token(
+        "bob",
+        "old",
+        json.dumps({"user": "bob"}),
+        ex_seconds=60,
+        max_sessions=10,
+        generation_ttl_seconds=60,
+    )
+    await redis_store.bump_token_generation("bob", ttl_seconds=60)
+
+    # returns the user's token generation
+    assert (
+        await redis_store.rotate_refresh_token(
+            "bob",
+            "old",
+            "new",
+            json.dumps({"user": "bob"}),
+            ex_seconds=60,
+            generation_ttl_seconds=60,
+        )
+        == 1
+    )
+    assert (
+        await redis_store.rotate_refresh_token(
+            "bob",
+            "old",
+            "newer",
+            json.dumps({"user": "bob"}),
+            ex_seconds=60,
+            generation_ttl_seconds=60,
+        )
+        is None
+    )
+
+    assert await real_redis.get(redis_store.refresh_token_key("bob", "old")) is None
+    assert await real_redis.ttl(redis_store.refresh_token_key("bob", "new")) > 0
+    assert await redis_store.get_user_refresh_tokens("bob") == {"new"}
+
+
+@pytest.mark.parametrize(
+    "token_info",
+    ["not json", json.dumps({"user": "mallory"}), '{"user": "bob", "revoked": true}'],
+)
+async def test_rotate_refresh_token_rejected(real_redis: aioredis.Redis, token_info):
+    """test invalid tokens are left alone"""
+
+    await real_redis.set(redis_store.refresh_token_key("bob", "old"), token_info)
+
+    assert (
+        await redis_store.rotate_refresh_token(
+            "bob", "old", "new", "{}", ex_seconds=60, generation_ttl_seconds=60
+        )
+        is None
+    )
+    assert (
+        await real_redis.get(redis_store.refresh_token_key("bob", "old")) == token_info
+    )
+    assert not await real_redis.exists(redis_store.refresh_token_key("bob", "new"))
+
+
+async def test_revoke_user_refresh_tokens(real_redis: aioredis.Redis):
+    """test every indexed token and the index are deleted, in batches"""
+
+    async with real_redis.pipeline() as pipe:
+        for i in range(2500):
+            pipe.set(redis_store.refresh_token_key("bob", f"t{i}"), "{}")
+            pipe.zadd(redis_store.user_refresh_tokens_key("bob"), {f"t{i}": i})
+        await pipe.execute()
+    await real_redis.set(redis_store.refresh_token_key("bob", "other"), "{}")
+
+    assert await redis_store.revoke_user_refresh_tokens("bob") == 2500
+
+    assert await real_redis.dbsize() == 1
+    assert await real_redis.exists(redis_store.refresh_token_key("bob", "other"))
+
+
+async def test_bump_token_generation(real_redis: aioredis.Redis):
+    """test bumping increments the generation and publishes it"""
+
+    async with real_redis.pubsub() as pubsub:
+        await pubsub.subscribe(redis_store.TOKEN_GENERATIONS_CHANNEL)
+
+        assert await redis_store.bump_token_generation("Bob", ttl_seconds=60) == 1
+        assert await redis_store.bump_token_generation("bob", ttl_seconds=60) == 2
+
+        messages = []
+        # the subscribe confirmation comes back as None
+        for _ in range(3):
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=1
+            )
+            if message:
+                messages.append(message["data"])
+
+    assert messages == ["1:bob", "2:bob"]
+    assert await redis_store.get_token_generation("bob") == 2
+    assert 0 < await real_redis.ttl(redis_store.token_generation_key("bob")) <= 60
+    assert [
+        (username, generation)
+        async for username, generation, _ in redis_store.recent_token_generations()
+    ] == [("bob", 2)]
+
+
+async def test_store_user_refresh_token_bounds_index(real_redis: aioredis.Redis):
+    """test expired tokens are trimmed and the oldest evicted past the cap"""
+
+    index_key = redis_store.user_refresh_tokens_key("bob")
+    # indexes from before they were sorted sets are converted, scored by their ttl
+    await real_redis.sadd(index_key, "legacy")
+    await real_redis.expire(index_key, 30)
+    await real_redis.set(redis_store.refresh_token_key("bob", "legacy"), "{}")
+
+    for i in range(3):
+        await redis_store.store_user_refresh_token(
+            "bob",
+            f"t{i}",
+            "{}",
+            ex_seconds=60,
+            max_sessions=3,
+            generation_ttl_seconds=60,
+        )
+
+    assert await real_redis.zrange(index_key, 0, -1) == ["t0", "t1", "t2"]
+    assert not await real_redis.exists(redis_store.refresh_token_key("bob", "legacy"))
+    # the index expiry is rounded up to a whole second for EXPIREAT
+    assert 58 <= await real_redis.ttl(index_key) <= 61
+
+    # a token whose expiry has passed is trimmed on the next write
+    await real_redis.zadd(index_key, {"t0": 0})
+    await redis_store.store_user_refresh_token(
+        "bob", "t3", "{}", ex_seconds=60, max_sessions=3, generation_ttl_seconds=60
+    )
+    assert await real_redis.zrange(index_key, 0, -1) == ["t1", "t2", "t3"]
@@ -0,0 +1,144 @@
+"""tests for resources.py"""
+
+# pylint: disable=protected-access,too-many-function-args
+
+import os
+from unittest import mock
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from tests.conftest import FakeRedis, MockParameters
+from userdb import db, resources, revocations
+from userdb import redis as redis_store
+from userdb.aws import s3, sfn, ssm
+
+
+@pytest.fixture(name="revocation_cache", autouse=True)
+def _revocation_cache():
+    with mock.patch.object(revocations, "cache") as cache:
+        cache.stop = mock.AsyncMock()
+        yield cache
+
+
+def _patch_databases(engine):
+    return (
+        mock.patch.object(db, "async_engine", engine),
+        mock.patch.object(db, "replica_engines", []),
+    )
+
+
+async def test_warm_up_opens_db_connections(db_path):
+    """test the configured number of connections are left open in the pool"""
+
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}", poolclass=AsyncAdaptedQueuePool
+    )
+    primary, replicas = _patch_databases(engine)
+
+    try:
+        with (
+            primary,
+            replicas,
+            mock.patch.dict(os.environ, {"WARMUP_DB_CONNECTIONS": "3"}),
+        ):
+            await resources.warm_up()
+
+        assert engine.pool.checkedin() == 3  # type: ignore[attr-defined]
+        assert engine.pool.checkedout() == 0  # type: ignore[attr-defined]
+    finally:
+        await engine.dispose()
+
+
+async def test_warm_up_pings_redis(fake_redis: FakeRedis):
+    """test redis is connected to at startup"""
+
+    with (
+        mock.patch.object(resources, "_warm_up_databases", mock.AsyncMock()),
+        mock.patch.object(fake_redis, "ping", wraps=fake_redis.ping) as mock_ping,
+    ):
+        await resources.warm_up()
+
+    mock_ping.assert_called_once()
+
+
+async def test_warm_up_is_best_effort(fake_redis: FakeRedis):
+    """test failures are logged rather than stopping startup"""
+
+    with (
+        mock.patch.object(
+            db, "warm_up_pool", mock.AsyncMock(side_effect=OSError("refused"))
+        ),
+        mock.patch.object(fake_redis, "ping", side_effect=ConnectionError("down")),
+        mock.patch.object(resources._logger, "exception") as mock_log,
+    ):
+        await resources.warm_up()
+
+    assert mock_log.call_count == 2
+
+
+async def test_warm_up_aws_disabled_by_default():
+    """test AWS clients aren't created unless asked for"""
+
+    with (
+        mock.patch.object(resources, "_warm_up_databases", mock.AsyncMock()),
+        mock.patch.object(resources, "_warm_up_aws") as mock_aws,
+    ):
+        await resources.warm_up()
+
+    mock_aws.assert_not_called()
+
+
+async def test_warm_up_aws():
+    """test AWS clients are created and parameters fetched when enabled"""
+
+    cached = [s3._client, sfn._client, ssm._client, ssm.get_parameter]
+    for func in cached:
+        func.cache_clear()
+
+    try:
+        with (
+            mock.patch.object(resources, "_warm_up_databases", mock.AsyncMock()),
+            mock.patch.dict(os.environ, {"WARMUP_AWS": "true"}),
+        ):
+            await resources.warm_up()
+
+        assert s3._client.cache_info().currsize == 1
+        assert sfn._client.cache_info().currsize == 1
+        assert ssm.get_parameter.cache_info().currsize == len(ssm.Parameter)
+        assert (
+            ssm.get_parameter(ssm.Parameter.STEP_FUNCTION_ARN)
+            == MockParameters.process_document_step_function_arn
+        )
+    finally:
+        for func in cached:
+            func.cache_clear()
+
+
+async def test_warm_up_starts_revocation_cache(revocation_cache):
+    """test the revocation cache starts following revocations"""
+
+    with mock.patch.object(resources, "_warm_up_databases", mock.AsyncMock()):
+        await resources.warm_up()
+
+    revocation_cache.start.assert_called_once()
+
+
+async def test_release(revocation_cache):
+    """
+    test the revocation cache is stopped, db engines disposed and the redis
+    client closed
+    """
+
+    with (
+        mock.patch.object(db, "dispose_engines", mock.AsyncMock()) as mock_dispose,
+        mock.patch.object(
+            redis_store, "close_redis", mock.AsyncMock()
+        ) as mock_close_redis,
+    ):
+        await resources.release()
+
+    revocation_cache.stop.assert_awaited_once()
+    mock_dispose.assert_awaited_once()
+    mock_close_redis.assert_awaited_once()
@@ -0,0 +1,197 @@
+"""tests for revocations.py"""
+
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from tests.conftest import FakeRedis
+from userdb import redis as redis_store
+from userdb import revocations
+from userdb.utils import auth
+
+
+async def _wait_until(predicate) -> None:
+    """let background tasks run until `predicate()` is true"""
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0)
+    raise AssertionError("timed out waiting")
+
+
+def _payload(username: str, generation: int = 0) -> dict:
+    return auth.verify_access_token(
+        auth.create_access_token(subject=username, generation=generation)
+    )
+
+
+async def _bump(username: str) -> int:
+    return await redis_store.bump_token_generation(
+        username, ttl_seconds=auth.TOKEN_GENERATION_TTL_SECONDS
+    )
+
+
+@pytest.fixture(name="cache")
+async def _cache():
+    """a generation cache standing in for this worker's"""
+    cache = revocations.GenerationCache()
+    with mock.patch.object(revocations, "cache", cache):
+        yield cache
+    await cache.stop()
+
+
+async def test_checks_redis_until_ready(cache, fake_redis: FakeRedis):
+    """test generations are read from Redis before the cache is following them"""
+
+    await _bump("bob")
+    fake_redis.round_trips = 0
+
+    assert not cache.ready
+    assert await revocations.is_revoked(_payload("bob"))
+    assert not await revocations.is_revoked(_payload("bob", generation=1))
+    assert fake_redis.round_trips == 2
+
+
+async def test_check_needs_no_round_trip(cache, fake_redis: FakeRedis):
+    """test checks are answered locally once the cache is following generations"""
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+    fake_redis.round_trips = 0
+
+    assert not await revocations.is_revoked(_payload("bob"))
+    assert fake_redis.round_trips == 0
+
+
+async def test_loads_existing_generations(cache):
+    """test generations bumped before startup are loaded"""
+
+    await _bump("Bob")
+    await _bump("bob")
+    await _bump("alice")
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+
+    assert cache.get("bob") == 2
+    assert cache.get("alice") == 1
+    assert cache.get("carol") == 0
+    assert await revocations.is_revoked(_payload("bob", generation=1))
+
+
+async def test_skips_lapsed_generations(cache, fake_redis: FakeRedis):
+    """test generations bumped longer ago than any live token aren't loaded"""
+
+    await _bump("bob")
+    await fake_redis.zadd(redis_store.TOKEN_GENERATION_BUMPS_KEY, {"bob": 1})
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+
+    assert cache.get("bob") == 0
+
+
+async def test_follows_generations_from_other_workers(cache):
+    """test generations bumped elsewhere are picked up from pub/sub"""
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+    payload = _payload("bob")
+
+    await _bump("bob")
+    await _wait_until(lambda: cache.get("bob") == 1)
+
+    assert await revocations.is_revoked(payload)
+
+
+async def test_revoke_all_updates_local_cache_immediately(cache):
+    """test this worker doesn't wait for its own pub/sub message"""
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+
+    with mock.patch.object(
+        redis_store, "bump_token_generation", mock.AsyncMock(return_value=4)
+    ):
+        await revocations.revoke_all("bob")
+
+    assert cache.get("bob") == 4
+
+
+def test_stale_updates_are_ignored():
+    """test a generation never goes backwards"""
+
+    cache = revocations.GenerationCache()
+    cache.update("bob", 2, time.time() + 60)
+    cache.update("bob", 1, time.time() + 60)
+
+    assert cache.get("bob") == 2
+
+
+def test_generations_lapse():
+    """test a generation stops counting, and can start again, once it lapses"""
+
+    cache = revocations.GenerationCache()
+    cache.update("bob", 2, time.time() - 1)
+    assert cache.get("bob") == 0
+
+    # the key expired in Redis too, so it's counting from 0 again
+    cache.update("bob", 1, time.time() + 60)
+    assert cache.get("bob") == 1
+
+
+async def test_lapsed_generations_are_evicted(cache, monkeypatch):
+    """test the cache drops generations that can no longer revoke anything"""
+
+    monkeypatch.setattr(revocations, "POLL_SECONDS", 0.001)
+    monkeypatch.setattr(revocations, "EVICT_SECONDS", 0)
+    cache.update("bob", 2, time.time() - 1)
+    cache.update("alice", 1, time.time() + 60)
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+    # asyncio.sleep is patched out, so idle for real for a few polls
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(asyncio.Event().wait(), 0.02)
+
+    # pylint: disable-next=protected-access
+    assert cache._generations.keys() == {"alice"}
+
+
+async def test_falls_back_to_redis_while_reconnecting(cache, fake_redis: FakeRedis):
+    """test a lost subscription stops local answers until it's re-established"""
+
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+    (pubsub,) = fake_redis.subscribers(redis_store.TOKEN_GENERATIONS_CHANNEL)
+
+    with mock.patch.object(
+        fake_redis, "zrangebyscore", side_effect=ConnectionError("down")
+    ) as mock_load:
+        pubsub.messages.put_nowait(ConnectionError("connection lost"))
+        await _wait_until(lambda: mock_load.call_count > 1)
+
+        assert not cache.ready
+        fake_redis.round_trips = 0
+        assert not await revocations.is_revoked(_payload("bob"))
+        assert fake_redis.round_trips == 1
+
+    await _wait_until(lambda: cache.ready)
+
+
+async def test_idle_subscription_stays_ready(cache, monkeypatch):
+    """test polling with no generations published keeps the subscription"""
+
+    monkeypatch.setattr(revocations, "POLL_SECONDS", 0.001)
+    cache.start()
+    await _wait_until(lambda: cache.ready)
+
+    # asyncio.sleep is patched out, so idle for real for a few polls
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(asyncio.Event().wait(), 0.02)
+
+    assert cache.ready
+    await _bump("bob")
+    await _wait_until(lambda: cache.get("bob") == 1)
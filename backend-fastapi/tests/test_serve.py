@@ -0,0 +1,99 @@
+"""tests for serve.py"""
+
+import os
+from unittest import mock
+
+from userdb import serve
+
+
+def test_worker_count_from_env():
+    """test WEB_CONCURRENCY sets the number of workers"""
+
+    with mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "3"}):
+        assert serve.worker_count() == 3
+
+    with mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "0"}):
+        assert serve.worker_count() == 1
+
+
+def test_worker_count_defaults_to_cpus():
+    """test one worker per usable CPU by default"""
+
+    with (
+        mock.patch.dict(os.environ),
+        mock.patch.object(os, "process_cpu_count", return_value=6),
+    ):
+        os.environ.pop("WEB_CONCURRENCY", None)
+        assert serve.worker_count() == 6
+
+
+def test_server_options_defaults():
+    """test default server settings"""
+
+    with mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "2"}):
+        options = serve.server_options()
+
+    assert options | {"log_level": None} == {
+        "host": "0.0.0.0",
+        "port": 80,
+        "workers": 2,
+        "loop": "uvloop",
+        "http": "httptools",
+        "backlog": 2048,
+        "timeout_keep_alive": 75,
+        "timeout_graceful_shutdown": 30,
+        "proxy_headers": True,
+        "forwarded_allow_ips": "127.0.0.1",
+        "log_level": None,
+    }
+
+
+def test_server_options_from_env():
+    """test server settings can be tuned from env"""
+
+    env = {
+        "PORT": "8080",
+        "SERVER_BACKLOG": "100",
+        "SERVER_KEEP_ALIVE_SECONDS": "10",
+        "SERVER_GRACEFUL_SHUTDOWN_SECONDS": "5",
+    }
+    with mock.patch.dict(os.environ, env):
+        options = serve.server_options()
+
+    assert options["port"] == 8080
+    assert options["backlog"] == 100
+    assert options["timeout_keep_alive"] == 10
+    assert options["timeout_graceful_shutdown"] == 5
+
+
+def test_server_options_without_uvloop_httptools():
+    """test the pure python loop and parser are used if the fast ones are missing"""
+
+    with mock.patch("importlib.util.find_spec", return_value=None):
+        options = serve.server_options()
+
+    assert options["loop"] == "asyncio"
+    assert options["http"] == "h11"
+
+
+def test_main_initialises_db_once():
+    """test the db is initialised before starting workers, which then skip it"""
+
+    calls = []
+    with (
+        mock.patch.object(
+            serve.db, "init_db", side_effect=lambda: calls.append("init")
+        ),
+        mock.patch.object(serve.db, "engine"),
+        mock.patch.object(serve.uvicorn, "run") as mock_run,
+        mock.patch.dict(os.environ, {"WEB_CONCURRENCY": "4"}),
+    ):
+        mock_run.side_effect = lambda *_, **__: calls.append(
+            os.environ[serve.SKIP_INIT_DB_ENV]
+        )
+        serve.main()
+
+    assert calls == ["init", "true"]
+    mock_run.assert_called_once()
+    assert mock_run.call_args.args == (serve.APP,)
+    assert mock_run.call_args.kwargs["workers"] == 4
@@ -0,0 +1,45 @@
+"""tests for utils/ids.py"""
+
+from unittest import mock
+import uuid
+
+from userdb.utils import ids
+
+
+def test_uuid7_version_and_variant():
+    """test ids are RFC 9562 version 7"""
+
+    value = ids.uuid7()
+
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+
+
+def test_uuid7_encodes_timestamp():
+    """test the leading 48 bits are the unix time in ms"""
+
+    with mock.patch.object(ids.time, "time_ns", return_value=1_700_000_000_123_456_789):
+        value = ids.uuid7()
+
+    assert value.int >> 80 == 1_700_000_000_123
+
+
+def test_uuid7_time_ordered():
+    """test ids from later milliseconds sort after earlier ones"""
+
+    values = []
+    for ms in range(100):
+        with mock.patch.object(ids.time, "time_ns", return_value=ms * 1_000_000):
+            values.append(ids.uuid7())
+
+    assert values == sorted(values)
+    assert [str(v) for v in values] == sorted(str(v) for v in values)
+
+
+def test_uuid7_unique():
+    """test ids in the same millisecond still differ"""
+
+    with mock.patch.object(ids.time, "time_ns", return_value=0):
+        values = {ids.uuid7() for _ in range(1000)}
+
+    assert len(values) == 1000
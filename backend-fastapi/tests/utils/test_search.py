@@ -0,0 +1,40 @@
+"""tests for utils/search.py"""
+
+import pytest
+from sqlalchemy import column
+from sqlalchemy.dialects import postgresql, sqlite
+
+from userdb.utils import search
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("Zoë", "zoe"),
+        ("ÉLODIE", "elodie"),
+        ("Ødegård", "odegard"),
+        ("Æthelstan", "aethelstan"),
+        ("O'Brien-Smith", "o'brien-smith"),
+    ],
+)
+def test_fold(value: str, expected: str):
+    """test case and accents are removed"""
+    assert search.fold(value) == expected
+
+
+def test_like_patterns_escape_wildcards():
+    """test LIKE wildcards in the search term are matched literally"""
+    assert search.like_contains("a%b_c\\") == "%a\\%b\\_c\\\\%"
+    assert search.like_prefix("a%") == "a\\%%"
+
+
+@pytest.mark.parametrize(
+    "dialect, expected",
+    [
+        (postgresql.dialect(), "f_unaccent(lower(name))"),
+        (sqlite.dialect(), f"{search.SQLITE_FOLD_FUNCTION}(name)"),
+    ],
+)
+def test_folded_compiles_per_dialect(dialect, expected: str):
+    """test `folded` uses the dialect's fold function"""
+    assert str(search.folded(column("name")).compile(dialect=dialect)) == expected
@@ -0,0 +1,42 @@
+"""tests for utils/auth.py (named to not clash with tests/routers/test_auth.py)"""
+
+import pytest
+
+from userdb.utils import auth
+
+
+@pytest.mark.parametrize("user_id", ["alice", "mary-jane", "o'brien"])
+def test_refresh_token_user(user_id: str):
+    """test the user id is recovered from a refresh token"""
+    token = auth.create_refresh_token(user_id=user_id)
+    assert auth.refresh_token_user(token) == user_id
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "",
+        "alice",
+        "refresh-",
+        "refresh-alice",
+        "refresh--7f0f6c9e-3d0e-4a53-9b7e-2c5d1f0e8a11",
+        "refresh-alice-not-a-uuid-not-a-uuid-not-a-uuid-not",
+        "access-alice-7f0f6c9e-3d0e-4a53-9b7e-2c5d1f0e8a11",
+    ],
+)
+def test_refresh_token_user_malformed(token: str):
+    """test malformed refresh tokens have no user"""
+    assert auth.refresh_token_user(token) is None
+
+
+def test_access_token_claims():
+    """test access tokens carry a unique id and the user's token generation"""
+    first = auth.verify_access_token(auth.create_access_token(subject="Bob"))
+    second = auth.verify_access_token(
+        auth.create_access_token(subject="bob", generation=2)
+    )
+
+    assert first["sub"] == second["sub"] == "bob"
+    assert first["gen"] == 0
+    assert second["gen"] == 2
+    assert first["jti"] != second["jti"]
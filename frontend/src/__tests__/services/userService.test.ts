@@ -44,12 +44,40 @@ describe('userService', () => {
 
     const result = await userService.getUsers();
 
-    expect(apiInstance.get).toHaveBeenCalledWith('/users');
+    expect(apiInstance.get).toHaveBeenCalledWith('/users', {
+      params: { limit: 1000, cursor: undefined },
+    });
     expect(result).toEqual([
       { ...mockUsers[0], dateOfBirth: dayjs('1990-01-01') },
     ]);
   });
 
+  test('getUsers follows the next page cursor', async () => {
+    MockDate.set('2022-01-01');
+
+    const user = {
+      firstname: 'John',
+      lastname: 'Doe',
+      dateOfBirth: '1990-01-01',
+      age: 365.25 * 32,
+    };
+
+    apiInstance.get
+      .mockResolvedValueOnce({
+        data: [{ ...user, id: '1' }],
+        headers: { 'x-next-cursor': 'abc' },
+      })
+      .mockResolvedValueOnce({ data: [{ ...user, id: '2' }], headers: {} });
+
+    const result = await userService.getUsers();
+
+    expect(apiInstance.get).toHaveBeenCalledTimes(2);
+    expect(apiInstance.get).toHaveBeenLastCalledWith('/users', {
+      params: { limit: 1000, cursor: 'abc' },
+    });
+    expect(result.map((u) => u.id)).toEqual(['1', '2']);
+  });
+
   test('createUser posts user data to API', async () => {
     MockDate.set('1991-01-01');
 
@@ -2,10 +2,21 @@ import dayjs from 'dayjs';
 import { api } from './api';
 import type { NewUser, User } from '../types/user';
 
+const PAGE_SIZE = 1000;
+
 export const userService = {
   async getUsers(): Promise<User[]> {
-    const resp = await api.get('/users');
-    const users: User[] = resp.data;
+    // the list is paged, follow the next page cursor until the last page
+    const users: User[] = [];
+    let cursor: string | undefined;
+    do {
+      const resp = await api.get('/users', {
+        params: { limit: PAGE_SIZE, cursor },
+      });
+      users.push(...resp.data);
+      cursor = resp.headers?.['x-next-cursor'];
+    } while (cursor);
+
     return users.map((user: User) => ({
       ...user,
       dateOfBirth: dayjs(user.dateOfBirth),